@@ -0,0 +1,136 @@
+"""
+Microbenchmark: single-pass message classifier vs the old per-list scans.
+
+    python bench/classifier_bench.py [--messages 20000] [--repeat 5]
+
+The "old" path below is the substring logic on_message and
+_should_respond_in_channel used before the classifier: lowercase the text
+per check and rebuild each phrase list inline.
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bot  # noqa: E402
+
+CHATTER = [
+    "anyone up for a round of slots later?",
+    "lol that dice duel was rigged",
+    "gm everyone",
+    "who won the lotto last night",
+    "brb making tea",
+    "I swear the roulette wheel hates me",
+    "can someone explain the weekly bonus",
+    "that's wild, no way",
+    "did mike push the new update yet?",
+    "ok but the leaderboard is broken again https://example.com/screenshot.png",
+    "hahaha",
+    "need 2 more for dice party",
+]
+TRIGGERS = [
+    "emz",
+    "auntie?",
+    "Emz are you and barrister a thing",
+    "blossem is here!!",
+    "EMZ what do you think of oreo",
+    "emilia please settle this",
+    "auntie emz how do i play dice party",
+    "emz what are the commands",
+    "auntie i need coins",
+    "50k coins please emz",
+    "can i get coins for testing",
+]
+
+
+def old_classify(content):
+    """Intents the old code path worked out, following its early returns."""
+    intents = set()
+    content_lower = (content or "").lower()
+    trigger_words = ["emz", "emilia", "blossem", "barrister"]
+    if not any(word in content_lower for word in trigger_words):
+        return frozenset(intents)
+    intents.add("trigger")
+
+    content_lower = (content or "").lower()
+    if any(
+        phrase in content_lower
+        for phrase in [
+            "coins please",
+            "50k coins",
+            "eli coins",
+            "elihaus coins",
+            "can i get coins",
+            "auntie i need coins",
+        ]
+    ):
+        intents.add("faucet")
+        return frozenset(intents)
+    if any(
+        phrase in content_lower
+        for phrase in [
+            "how to play",
+            "how do i play",
+            "how do i use",
+            "teach me",
+            "what are the commands",
+            "elihaus commands",
+            "elihaus help",
+            "help me auntie",
+        ]
+    ):
+        intents.add("how_to")
+    if any(word in content_lower for word in ["auntie", "emz", "auntie emz"]):
+        intents.add("mentions_auntie")
+    return frozenset(intents)
+
+
+def agrees(old, new):
+    """The old path stops early, so it only has to agree on what it computed."""
+    if "trigger" not in old:
+        return "trigger" not in new
+    if "faucet" in old:
+        return "faucet" in new
+    return old == new - {"faucet"}
+
+
+def make_corpus(n, trigger_share, seed=7):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        pool = TRIGGERS if rng.random() < trigger_share else CHATTER
+        text = rng.choice(pool)
+        if rng.random() < 0.3:
+            text = f"{rng.choice(CHATTER)} {text}"
+        corpus.append(text)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    classify = bot.message_classifier.classify
+    for share in (0.05, 0.25, 1.0):
+        corpus = make_corpus(args.messages, share)
+        mismatches = sum(1 for text in corpus if not agrees(old_classify(text), classify(text)))
+        old = min(timeit.repeat(lambda: [old_classify(t) for t in corpus], number=1, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: [classify(t) for t in corpus], number=1, repeat=args.repeat))
+        per_old = old / len(corpus) * 1e6
+        per_new = new / len(corpus) * 1e6
+        print(
+            f"trigger share {share:>4.0%}: old {per_old:5.2f} us/msg, new {per_new:5.2f} us/msg "
+            f"({per_old / per_new:4.2f}x), mismatches {mismatches}"
+        )
+
+
+if __name__ == "__main__":
+    main()
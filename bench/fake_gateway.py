@@ -0,0 +1,318 @@
+"""
+Local stand-in for the Discord gateway and the REST routes the bot touches.
+
+Run it, then point one or more shard processes at it:
+
+    python bench/fake_gateway.py --port 8090 --guilds 16
+    DISCORD_API_BASE=http://127.0.0.1:8090/api/v10 \
+    DISCORD_GATEWAY_URL=ws://127.0.0.1:8090/gateway \
+    SHARD_COUNT=4 SHARD_PROCESSES=2 SHARD_IDENTIFY_DELAY_SECONDS=0 \
+    DISCORD_TOKEN=fake OPENAI_API_KEY=fake python bot.py
+
+Guild i has snowflake i << 22, so it belongs to shard i % shard_count.
+POST /drive?messages=N&rate=R pushes N triggering MESSAGE_CREATE events to
+whichever shard owns each guild; GET /stats reports shard sessions, replies
+and reply latency (gateway dispatch -> POST of the reply).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+from aiohttp import WSMsgType, web
+
+DISCORD_EPOCH_MS = 1420070400000
+BOT_ID = 900_000_000_000_000_001
+CHATTER = [
+    "what do you think about the weekly bonus",
+    "who won the lotto last night",
+    "is the roulette wheel rigged",
+    "say something nice about mike",
+    "the leaderboard is broken again",
+    "are you and barrister a thing",
+]
+
+
+class _Snowflakes:
+    def __init__(self):
+        self._seq = 0
+
+    def next(self) -> int:
+        self._seq = (self._seq + 1) & 0x3FFFFF
+        return ((int(time.time() * 1000) - DISCORD_EPOCH_MS) << 22) | self._seq
+
+
+def _user(uid: int, *, bot: bool = False) -> dict:
+    return {
+        "id": str(uid),
+        "username": "auntie-emz" if bot else f"user{uid}",
+        "discriminator": "0",
+        "global_name": "Auntie Emz" if bot else f"User {uid % 100_000}",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def _guild(index: int, channels: int) -> dict:
+    guild_id = index << 22
+    return {
+        "id": str(guild_id),
+        "name": f"guild {index}",
+        "owner_id": "1",
+        "member_count": 1,
+        "unavailable": False,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [
+            {"id": str(guild_id + 1 + c), "type": 0, "name": f"chan-{c}", "position": c, "permission_overwrites": []}
+            for c in range(channels)
+        ],
+        "members": [],
+        "emojis": [],
+        "stickers": [],
+        "threads": [],
+        "voice_states": [],
+        "presences": [],
+    }
+
+
+def _json(data, status: int = 200) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json.
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+
+def make_app(guilds: int = 16, channels: int = 4, users: int = 5000) -> web.Application:
+    app = web.Application()
+    snowflakes = _Snowflakes()
+    guild_payloads = [_guild(i, channels) for i in range(guilds)]
+    # shard id -> live websocket; message id -> monotonic dispatch time
+    sessions: Dict[int, web.WebSocketResponse] = {}
+    dispatched: Dict[int, float] = {}
+    latencies: List[float] = []
+    stats = {"identifies": 0, "ready_shards": 0, "sent": 0, "undelivered": 0, "replies": 0, "edits": 0, "typing": 0}
+    app["stats"] = stats
+
+    async def _dispatch(ws: web.WebSocketResponse, seq: List[int], event: str, data: dict):
+        seq[0] += 1
+        await ws.send_str(json.dumps({"op": 0, "t": event, "s": seq[0], "d": data}))
+
+    async def gateway(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}}))
+        seq = [0]
+        shard_id = None
+        ws["seq"] = seq
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                op = payload.get("op")
+                if op == 1:
+                    await ws.send_str(json.dumps({"op": 11}))
+                elif op == 8:
+                    # Member chunk request: the synthetic guilds have no members to send.
+                    request_data = payload["d"]
+                    await _dispatch(ws, seq, "GUILD_MEMBERS_CHUNK", {
+                        "guild_id": request_data["guild_id"],
+                        "members": [],
+                        "chunk_index": 0,
+                        "chunk_count": 1,
+                        "nonce": request_data.get("nonce"),
+                    })
+                elif op == 2:
+                    shard_id, shard_count = payload["d"].get("shard") or (0, 1)
+                    stats["identifies"] += 1
+                    stats["shard_count"] = shard_count
+                    sessions[shard_id] = ws
+                    await _dispatch(ws, seq, "READY", {
+                        "v": 10,
+                        "user": _user(BOT_ID, bot=True),
+                        "guilds": [],
+                        "session_id": f"fake-{shard_id}-{random.getrandbits(32):x}",
+                        "resume_gateway_url": str(request.url.with_query(None)),
+                        "shard": [shard_id, shard_count],
+                        "application": {"id": str(BOT_ID), "flags": 0},
+                    })
+                    for index, guild in enumerate(guild_payloads):
+                        if index % shard_count == shard_id:
+                            await _dispatch(ws, seq, "GUILD_CREATE", guild)
+                    stats["ready_shards"] = len(sessions)
+        finally:
+            if shard_id is not None and sessions.get(shard_id) is ws:
+                del sessions[shard_id]
+                stats["ready_shards"] = len(sessions)
+        return ws
+
+    async def drive(request: web.Request) -> web.Response:
+        count = int(request.query.get("messages", "100"))
+        rate = float(request.query.get("rate", "50"))
+        shard_count = stats.get("shard_count", 1)
+
+        async def _run():
+            for i in range(count):
+                index = random.randrange(guilds)
+                guild = guild_payloads[index]
+                channel = random.choice(guild["channels"])
+                uid = 1_000_000 + random.randrange(users)
+                message_id = snowflakes.next()
+                data = {
+                    "id": str(message_id),
+                    "channel_id": channel["id"],
+                    "guild_id": guild["id"],
+                    "author": _user(uid),
+                    "member": {"roles": [], "joined_at": "2025-01-01T00:00:00+00:00", "deaf": False,
+                               "mute": False, "flags": 0},
+                    "content": f"emz {random.choice(CHATTER)} #{i}",
+                    "timestamp": "2026-01-01T00:00:00+00:00",
+                    "edited_timestamp": None,
+                    "tts": False,
+                    "mention_everyone": False,
+                    "mentions": [],
+                    "mention_roles": [],
+                    "attachments": [],
+                    "embeds": [],
+                    "pinned": False,
+                    "type": 0,
+                }
+                ws = sessions.get(index % shard_count)
+                if ws is None or ws.closed:
+                    stats["undelivered"] += 1
+                else:
+                    dispatched[message_id] = time.monotonic()
+                    await _dispatch(ws, ws["seq"], "MESSAGE_CREATE", data)
+                    stats["sent"] += 1
+                await asyncio.sleep(1 / rate)
+
+        asyncio.get_running_loop().create_task(_run())
+        return _json({"queued": count})
+
+    async def reset(request: web.Request) -> web.Response:
+        for key in ("sent", "undelivered", "replies", "edits", "typing"):
+            stats[key] = 0
+        dispatched.clear()
+        latencies.clear()
+        return _json(stats)
+
+    async def get_stats(request: web.Request) -> web.Response:
+        ordered = sorted(latencies)
+
+        def pct(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else 0.0
+
+        return _json(dict(stats, p50_ms=pct(0.50), p99_ms=pct(0.99)))
+
+    # ----- REST -----
+
+    async def me(request: web.Request) -> web.Response:
+        return _json(_user(BOT_ID, bot=True))
+
+    async def application(request: web.Request) -> web.Response:
+        return _json({
+            "id": str(BOT_ID),
+            "name": "Auntie Emz",
+            "icon": None,
+            "description": "",
+            "bot_public": True,
+            "bot_require_code_grant": False,
+            "owner": _user(1),
+            "verify_key": "0" * 64,
+            "flags": 0,
+        })
+
+    async def bot_gateway(request: web.Request) -> web.Response:
+        url = str(request.url.with_path("/gateway").with_query(None)).replace("http", "ws", 1)
+        return _json({
+            "url": url,
+            "shards": 1,
+            "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 16},
+        })
+
+    async def commands(request: web.Request) -> web.Response:
+        return _json([])
+
+    async def create_message(request: web.Request) -> web.Response:
+        payload = await request.json()
+        reference = (payload.get("message_reference") or {}).get("message_id")
+        started = dispatched.pop(int(reference), None) if reference else None
+        if started is not None:
+            latencies.append(time.monotonic() - started)
+        stats["replies"] += 1
+        channel_id = request.match_info["channel_id"]
+        return _json({
+            "id": str(snowflakes.next()),
+            "channel_id": channel_id,
+            "author": _user(BOT_ID, bot=True),
+            "content": payload.get("content") or "",
+            "timestamp": "2026-01-01T00:00:00+00:00",
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 19 if reference else 0,
+        })
+
+    async def edit_message(request: web.Request) -> web.Response:
+        stats["edits"] += 1
+        payload = await request.json()
+        return _json({
+            "id": request.match_info["message_id"],
+            "channel_id": request.match_info["channel_id"],
+            "author": _user(BOT_ID, bot=True),
+            "content": payload.get("content") or "",
+            "timestamp": "2026-01-01T00:00:00+00:00",
+            "edited_timestamp": "2026-01-01T00:00:01+00:00",
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        })
+
+    async def typing(request: web.Request) -> web.Response:
+        stats["typing"] += 1
+        return web.Response(status=204)
+
+    app.router.add_get("/gateway", gateway)
+    app.router.add_post("/drive", drive)
+    app.router.add_post("/reset", reset)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/api/v10/users/@me", me)
+    app.router.add_get("/api/v10/oauth2/applications/@me", application)
+    app.router.add_get("/api/v10/gateway/bot", bot_gateway)
+    app.router.add_put("/api/v10/applications/{app_id}/commands", commands)
+    app.router.add_post("/api/v10/channels/{channel_id}/messages", create_message)
+    app.router.add_patch("/api/v10/channels/{channel_id}/messages/{message_id}", edit_message)
+    app.router.add_post("/api/v10/channels/{channel_id}/typing", typing)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--guilds", type=int, default=16)
+    parser.add_argument("--channels", type=int, default=4, help="text channels per guild")
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.guilds, args.channels, args.users),
+        host=args.host,
+        port=args.port,
+        print=lambda *_: print(json.dumps({"listening": f"http://{args.host}:{args.port}/api/v10"})),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Local stand-in for the OpenAI chat.completions endpoint.
+
+Run it, then point the bot at it:
+
+    python bench/fake_openai.py --port 8089 --latency-ms 400 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python bot.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+CANNED = [
+    "Right. I heard you the first time.",
+    "Not today. Try again after a cup of tea.",
+    "Fine, but only because you asked nicely. Barely.",
+    "Let’s not start a soap opera today.",
+]
+
+
+def _completion_body(model: str, text: str, prompt_chars: int) -> dict:
+    prompt_tokens = max(prompt_chars // 4, 1)
+    completion_tokens = max(len(text) // 4, 1)
+    return {
+        "id": f"chatcmpl-fake-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+async def _stream(
+    request: web.Request, model: str, text: str, chunk_ms: float, prompt_chars: int, include_usage: bool
+) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    try:
+        await _write_chunks(response, model, text, chunk_ms, prompt_chars, include_usage)
+    except ConnectionResetError:
+        # The client closed the stream early; nothing more to send.
+        pass
+    return response
+
+
+async def _write_chunks(
+    response: web.StreamResponse, model: str, text: str, chunk_ms: float, prompt_chars: int, include_usage: bool
+):
+    created = int(time.time())
+    for i, word in enumerate(text.split(" ")):
+        piece = word if i == 0 else " " + word
+        chunk = {
+            "id": "chatcmpl-fake-stream",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+        }
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await asyncio.sleep(chunk_ms / 1000)
+    if include_usage:
+        # Like the real API: a final chunk with no choices carrying the usage block.
+        usage = _completion_body(model, text, prompt_chars)["usage"]
+        chunk = {
+            "id": "chatcmpl-fake-stream",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        }
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+
+
+def make_app(
+    latency_ms: float = 300,
+    jitter_ms: float = 100,
+    error_rate: float = 0.0,
+    chunk_ms: float = 40,
+) -> web.Application:
+    app = web.Application()
+    app["stats"] = {"requests": 0, "errors": 0, "prompt_chars": 0}
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        stats = request.app["stats"]
+        stats["requests"] += 1
+        payload = await request.json()
+        prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages", []))
+        stats["prompt_chars"] += prompt_chars
+
+        delay = max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response(
+                {"error": {"message": "fake upstream error", "type": "server_error"}},
+                status=500,
+            )
+
+        text = random.choice(CANNED)
+        if payload.get("stream"):
+            include_usage = bool((payload.get("stream_options") or {}).get("include_usage"))
+            return await _stream(request, payload.get("model", "fake"), text, chunk_ms, prompt_chars, include_usage)
+        return web.json_response(_completion_body(payload.get("model", "fake"), text, prompt_chars))
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(request.app["stats"])
+
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-ms", type=float, default=40, help="delay between streamed chunks")
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.latency_ms, args.jitter_ms, args.error_rate, args.chunk_ms),
+        host=args.host,
+        port=args.port,
+        print=lambda *_: print(json.dumps({"listening": f"http://{args.host}:{args.port}/v1"})),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Memory report: default client caches vs LEAN_MODE on a synthetic guild.
+
+    python bench/lean_memory.py [--members 50000] [--channels 300] [--guilds 3] [--messages 5000]
+
+Each mode runs in its own subprocess. The guilds are built from GUILD_CREATE
+style payloads (with every member included, as after chunking), the lean
+cache policy is applied the way on_guild_available does, and --messages
+MESSAGE_CREATE payloads are pushed into the message cache. Only the first
+guild holds the configured help/tester channels. "traced MB" is what the
+client caches retain; "RSS MB" is the whole process, payloads included.
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+HELP_CHANNEL = 10_001
+TESTER_CHANNEL = 10_002
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _user(uid: int) -> dict:
+    return {"id": str(uid), "username": f"user{uid}", "discriminator": "0", "avatar": None, "global_name": f"User {uid}"}
+
+
+def _guild_payload(guild_id: int, members: int, channels: int, first: bool) -> dict:
+    channel_ids = list(range(guild_id * 100_000, guild_id * 100_000 + channels))
+    if first:
+        channel_ids[:2] = [HELP_CHANNEL, TESTER_CHANNEL]
+    return {
+        "id": str(guild_id),
+        "name": f"guild {guild_id}",
+        "owner_id": "1",
+        "member_count": members,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [
+            {"id": str(cid), "type": 0, "name": f"chan-{cid}", "position": i, "permission_overwrites": []}
+            for i, cid in enumerate(channel_ids)
+        ],
+        "members": [
+            {"user": _user(guild_id * 10_000_000 + i), "roles": [], "joined_at": "2025-01-01T00:00:00+00:00",
+             "deaf": False, "mute": False, "nick": None, "flags": 0}
+            for i in range(members)
+        ],
+        "emojis": [],
+        "stickers": [],
+        "threads": [],
+    }
+
+
+def _message_payload(i: int, guild_id: int, channel_id: int) -> dict:
+    uid = guild_id * 10_000_000 + i % 1000
+    return {
+        "id": str(1_000_000_000 + i),
+        "channel_id": str(channel_id),
+        "guild_id": str(guild_id),
+        "author": _user(uid),
+        "member": {"roles": [], "joined_at": "2025-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+        "content": f"message {i} about the weekly bonus and who won the lotto",
+        "timestamp": "2026-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+def measure(args) -> dict:
+    os.environ.setdefault("DISCORD_TOKEN", "bench")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["HELP_CHANNEL_IDS"] = str(HELP_CHANNEL)
+    os.environ["TESTER_CHANNEL_IDS"] = str(TESTER_CHANNEL)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import discord
+    import bot
+
+    payloads = [_guild_payload(g + 1, args.members, args.channels, g == 0) for g in range(args.guilds)]
+    messages = [
+        _message_payload(i, 1 + i % args.guilds, HELP_CHANNEL if i % args.guilds == 0 else (1 + i % args.guilds) * 100_000 + 5)
+        for i in range(args.messages)
+    ]
+    gc.collect()
+    tracemalloc.start()
+
+    state = bot.bot._connection
+    for data in payloads:
+        guild = state._add_guild_from_data(data)
+        bot.apply_cache_policy(guild)
+    for data in messages:
+        channel, _ = state._get_guild_channel(data)
+        message = discord.Message(state=state, channel=channel, data=data)
+        if state._messages is not None:
+            state._messages.append(message)
+    payloads = messages = None
+    gc.collect()
+
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mode": "lean" if bot.LEAN_MODE else "default",
+        "guilds": len(state._guilds),
+        "channels": sum(len(g._channels) for g in state._guilds.values()),
+        "members": sum(len(g._members) for g in state._guilds.values()),
+        "messages": len(state._messages or ()),
+        "traced_mb": traced / 2**20,
+        "rss_mb": _rss_kb() / 1024,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    p.add_argument("--members", type=int, default=50_000)
+    p.add_argument("--channels", type=int, default=300)
+    p.add_argument("--guilds", type=int, default=3)
+    p.add_argument("--messages", type=int, default=5_000)
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args)))
+        return
+
+    rows = []
+    for lean in ("0", "1"):
+        env = dict(os.environ, LEAN_MODE=lean)
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", *sys.argv[1:]],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        rows.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{args.guilds} guilds x {args.members} members x {args.channels} channels, {args.messages} messages")
+    print(f"{'mode':8} {'guilds':>6} {'channels':>8} {'members':>8} {'messages':>8} {'traced MB':>10} {'RSS MB':>8}")
+    for r in rows:
+        print(
+            f"{r['mode']:8} {r['guilds']:>6} {r['channels']:>8} {r['members']:>8} {r['messages']:>8} "
+            f"{r['traced_mb']:>10.1f} {r['rss_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
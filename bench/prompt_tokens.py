@@ -0,0 +1,77 @@
+"""
+Report system-prompt input size before/after flag-aware prompt assembly.
+
+    python bench/prompt_tokens.py
+
+Uses tiktoken when it is installed, otherwise estimates 1 token per 4 chars.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bot  # noqa: E402
+
+try:
+    import tiktoken
+
+    _enc = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_enc.encode(text))
+
+    COUNTER = "tiktoken o200k_base"
+except ImportError:
+
+    def count_tokens(text: str) -> int:
+        return max(len(text) // 4, 1)
+
+    COUNTER = "estimate (chars / 4)"
+
+# (content, author_display, is_oreo, is_emz, tester_tier, protected)
+SAMPLES = [
+    ("emz", "randomuser", False, False, "none", False),
+    ("auntie?", "randomuser", False, False, "none", False),
+    ("barrister? are you two a thing", "nosy", False, False, "none", False),
+    ("oreo is causing chaos again emz", "gossip", False, False, "none", False),
+    ("hi emz it's me", "Oreo", True, False, "none", False),
+    ("morning all", "Blossem", False, True, "none", False),
+    ("emz tell jurye the dice bot broke", "Jurye", False, False, "elite", True),
+    ("auntie, mic said the slots are fixed", "lurker", False, False, "helper", True),
+    ("emz is yaeli your sugar mum", "cheeky", False, False, "none", False),
+    ("emz how is nova doing", "friend", False, False, "detective", True),
+]
+
+
+def main():
+    full = count_tokens(bot.AUNTIE_EMZ_SYSTEM_PROMPT)
+    print(f"Token counter: {COUNTER}")
+    print(f"Full prompt: {full} tokens ({len(bot.AUNTIE_EMZ_SYSTEM_PROMPT)} chars)\n")
+    print(f"{'message':<42} {'sections':<28} {'tokens':>6} {'saved':>6}")
+
+    total_after = 0
+    for content, author, is_oreo, is_emz, tier, protected in SAMPLES:
+        sections = bot.prompt_sections_for(
+            content=content,
+            author_display=author,
+            is_oreo=is_oreo,
+            is_emz=is_emz,
+            tester_tier=tier,
+            is_protected_tester=protected,
+        )
+        tokens = count_tokens(bot.build_system_prompt(sections))
+        total_after += tokens
+        print(f"{content[:40]:<42} {','.join(sections) or '-':<28} {tokens:>6} {full - tokens:>6}")
+
+    total_before = full * len(SAMPLES)
+    print(
+        f"\nTotal over {len(SAMPLES)} calls: {total_before} -> {total_after} tokens "
+        f"({100 * (total_before - total_after) / total_before:.0f}% fewer)"
+    )
+
+
+if __name__ == "__main__":
+    main()
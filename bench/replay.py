@@ -0,0 +1,355 @@
+"""
+Load replay: a message stream through on_message with no Discord connection.
+
+    python bench/replay.py [--messages 2000] [--rate 100] [--latency-ms 300] [--error-rate 0.02]
+    python bench/replay.py --input stream.jsonl        # replay a recorded stream
+    python bench/replay.py --save stream.jsonl ...     # keep the synthetic one
+
+fake_openai runs as a subprocess with the given latency and error rate, and
+bot.py is imported in this process against a fresh SQLite file. Messages
+are fake Message/channel/author objects handed straight to on_message at
+their recorded offsets; replies land in the fake channels. A stream file
+is JSON lines of {"t": seconds, "channel_id", "author_id", "content"},
+optionally with "author_name" and "mention" (the bot is @mentioned).
+
+Reports reply throughput, p50/p99 latency (on_message -> first reply to
+that message), OpenAI calls per 1k messages and peak RSS. Rate limits,
+burst coalescing and the spam gate keep their defaults (or whatever the
+environment sets), so the numbers match what production would do;
+--unthrottled lifts the rate limits to measure the pipeline itself.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNTHROTTLED = dict(
+    OPENAI_MAX_CONCURRENCY="64",
+    INTAKE_QUEUE_SIZE="5000",
+    RATE_GLOBAL_PER_MIN="1000000",
+    RATE_GLOBAL_BURST="10000",
+    RATE_CHANNEL_PER_MIN="1000000",
+    RATE_CHANNEL_BURST="10000",
+    RATE_USER_PER_MIN="1000000",
+    RATE_USER_BURST="10000",
+    DISCORD_SEND_PER_MIN="1000000",
+    DISCORD_SEND_BURST="10000",
+    SPAM_MAX_PER_WINDOW="1000000",
+)
+BOT_ID = 900_000_000_000_000_001
+CHATTER = [
+    "what do you think about the weekly bonus",
+    "who won the lotto last night",
+    "is the roulette wheel rigged",
+    "say something nice about mike",
+    "the leaderboard is broken again",
+    "are you and barrister a thing",
+    "anyone around for blackjack",
+    "my spins keep landing on zero",
+]
+
+
+def synthetic_stream(messages: int, rate: float, channels: int, users: int, trigger_ratio: float) -> list:
+    """Poisson arrivals; `trigger_ratio` of the messages address Auntie."""
+    events, t = [], 0.0
+    for i in range(messages):
+        t += random.expovariate(rate)
+        uid = 1_000_000 + random.randrange(users)
+        text = random.choice(CHATTER)
+        triggered = random.random() < trigger_ratio
+        events.append({
+            "t": round(t, 4),
+            "channel_id": 10_000 + random.randrange(channels),
+            "author_id": uid,
+            "author_name": f"User {uid % 100_000}",
+            "content": f"emz {text} #{i}" if triggered else f"{text} #{i}",
+            "mention": triggered and random.random() < 0.2,
+        })
+    return events
+
+
+def load_stream(path: str) -> list:
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+# ----- fake discord objects -----
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild {guild_id}"
+
+
+class FakeAuthor:
+    def __init__(self, uid: int, name: str, bot: bool = False):
+        self.id = uid
+        self.name = self.display_name = self.global_name = name
+        self.bot = bot
+        self.mention = f"<@{uid}>"
+
+    def mentioned_in(self, message) -> bool:
+        return any(user.id == self.id for user in message.mentions)
+
+
+class Recorder:
+    """Collects what the bot sent, keyed by the message it answered."""
+
+    def __init__(self):
+        self.received: dict = {}
+        self.latencies: list = []
+        self.sends = 0
+        self.edits = 0
+        self.typing = 0
+
+    def replied(self, reference):
+        self.sends += 1
+        started = self.received.pop(reference.id, None) if reference is not None else None
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def _make_channel_class(discord, state, recorder: Recorder):
+    class FakeChannel(discord.abc.Messageable):
+        """Text channel that records sends instead of calling Discord."""
+
+        def __init__(self, channel_id: int, guild: FakeGuild):
+            self.id = channel_id
+            self.name = f"chan-{channel_id}"
+            self.guild = guild
+            self._ids = channel_id << 22
+
+        async def _get_channel(self):
+            return self
+
+        async def send(self, content=None, *, reference=None, **kwargs):
+            recorder.replied(reference)
+            self._ids += 1
+            return FakeMessage(self._ids, self, BOT_USER, content or "")
+
+        @asynccontextmanager
+        async def typing(self):
+            recorder.typing += 1
+            yield
+
+    class FakeMessage:
+        # commands.Context reads the connection state off the message.
+        _state = state
+
+        def __init__(self, message_id: int, channel, author, content: str, mentions=()):
+            self.id = message_id
+            self.channel = channel
+            self.guild = channel.guild
+            self.author = author
+            self.content = content
+            self.mentions = list(mentions)
+            self.mention_everyone = False
+            self.reference = None
+            self.attachments = []
+            self.created_at = datetime.now(timezone.utc)
+
+        async def reply(self, content=None, **kwargs):
+            return await self.channel.send(content, reference=self, **kwargs)
+
+        async def edit(self, *, content=None, **kwargs):
+            recorder.edits += 1
+            self.content = content
+            return self
+
+    BOT_USER = FakeAuthor(BOT_ID, "Auntie Emz", bot=True)
+    return FakeChannel, FakeMessage, BOT_USER
+
+
+# ----- run -----
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _pct(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else 0.0
+
+
+async def replay(args, events: list) -> dict:
+    # Imported here, once main() has pointed the environment at the fakes.
+    import discord
+
+    import bot
+
+    recorder = Recorder()
+    FakeChannel, FakeMessage, bot_user = _make_channel_class(discord, bot.bot._connection, recorder)
+    # The pipeline only needs bot.user for mentions and the command prefix.
+    bot.bot._connection.user = discord.ClientUser(
+        state=bot.bot._connection,
+        data={"id": str(BOT_ID), "username": "auntie-emz", "discriminator": "0", "avatar": None, "bot": True},
+    )
+    # Entering the client sets up its loop so events (command errors) can be dispatched.
+    async with bot.bot:
+        await bot.setup_storage()
+
+        guild = FakeGuild(1 << 22)
+        channels: dict = {}
+        authors: dict = {}
+        started = time.perf_counter()
+        for seq, event in enumerate(events):
+            wait = started + event["t"] / args.speed - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            channel = channels.get(event["channel_id"])
+            if channel is None:
+                channel = channels[event["channel_id"]] = FakeChannel(event["channel_id"], guild)
+            author = authors.get(event["author_id"])
+            if author is None:
+                name = event.get("author_name") or f"User {event['author_id']}"
+                author = authors[event["author_id"]] = FakeAuthor(event["author_id"], name)
+            content = event["content"]
+            mentions = ()
+            if event.get("mention"):
+                content = f"<@{BOT_ID}> {content}"
+                mentions = (bot_user,)
+            message = FakeMessage(seq + 1, channel, author, content, mentions)
+            recorder.received[message.id] = time.perf_counter()
+            await bot.on_message(message)
+        sent_at = time.perf_counter()
+
+        # Drain: stop once nothing is queued or running and no reply has gone out for a while.
+        idle_since, last_sends = time.perf_counter(), -1
+        deadline = sent_at + args.drain_timeout
+        while time.perf_counter() < deadline:
+            busy = bot.intake.depth or bot.intake.busy or bot.outbound.depth
+            if busy or recorder.sends != last_sends:
+                idle_since, last_sends = time.perf_counter(), recorder.sends
+            elif time.perf_counter() - idle_since >= args.idle:
+                break
+            await asyncio.sleep(0.05)
+        finished = idle_since if recorder.sends else sent_at
+
+    await bot.intake.close()
+    await bot.tester_log_sink.close()
+    await bot.usage_ledger.close()
+    await bot.db.close()
+    await bot.client_oa.close()
+    return {
+        "messages": len(events),
+        "triggered": int(sum(bot.TRIGGERS._values.values())),
+        "replies": recorder.sends,
+        "answered": len(recorder.latencies),
+        "coalesced": bot.coalescer.merged,
+        "suppressed": dict(bot.spam_gate.suppressed),
+        "intake_dropped": sum(bot.intake.dropped.values()),
+        "edits": recorder.edits,
+        "elapsed": finished - started,
+        "send_window": sent_at - started,
+        "p50_ms": _pct(recorder.latencies, 0.50),
+        "p99_ms": _pct(recorder.latencies, 0.99),
+        "fallbacks": {"/".join(k): int(v) for k, v in bot.FALLBACKS._values.items()},
+    }
+
+
+async def main_async(args, events: list):
+    env = dict(os.environ)
+    fake = subprocess.Popen(
+        [
+            sys.executable, os.path.join(HERE, "fake_openai.py"),
+            "--port", str(args.openai_port),
+            "--latency-ms", str(args.latency_ms),
+            "--jitter-ms", str(args.latency_ms / 4),
+            "--error-rate", str(args.error_rate),
+        ],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        fake.stdout.readline()  # {"listening": ...}
+        result = await replay(args, events)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{args.openai_port}/stats") as resp:
+                upstream = await resp.json()
+    finally:
+        fake.terminate()
+        fake.wait()
+    result["api_calls"] = upstream["requests"]
+    result["api_errors"] = upstream["errors"]
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    p.add_argument("--input", help="JSONL stream to replay instead of a synthetic one")
+    p.add_argument("--save", help="write the stream used to this JSONL file")
+    p.add_argument("--messages", type=int, default=2000)
+    p.add_argument("--rate", type=float, default=100, help="synthetic messages per second")
+    p.add_argument("--channels", type=int, default=20)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--trigger-ratio", type=float, default=0.3, help="share of synthetic messages addressing Auntie")
+    p.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    p.add_argument("--latency-ms", type=float, default=300)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--unthrottled", action="store_true", help="lift OpenAI/Discord rate limits and the spam cap")
+    p.add_argument("--idle", type=float, default=2.0, help="seconds without sends that end the run")
+    p.add_argument("--drain-timeout", type=float, default=120.0)
+    p.add_argument("--openai-port", type=int, default=8289)
+    p.add_argument("--verbose", action="store_true", help="keep the bot's logging")
+    p.add_argument("--json", action="store_true")
+    args = p.parse_args()
+
+    random.seed(args.seed)
+    if args.input:
+        events = load_stream(args.input)
+    else:
+        events = synthetic_stream(args.messages, args.rate, args.channels, args.users, args.trigger_ratio)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.writelines(json.dumps(e) + "\n" for e in events)
+
+    db_dir = tempfile.mkdtemp(prefix="auntie-replay-")
+    if args.unthrottled:
+        os.environ.update(UNTHROTTLED)
+    os.environ.update(
+        DISCORD_TOKEN=os.environ.get("DISCORD_TOKEN", "replay"),
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "replay"),
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+        DB_PATH=os.path.join(db_dir, "auntie.db"),
+    )
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    if not args.verbose:
+        import logging
+        logging.disable(logging.WARNING)
+
+    r = asyncio.run(main_async(args, events))
+    n = r["messages"]
+    print(f"{n} messages over {r['send_window']:.1f}s, fake OpenAI ~{args.latency_ms:.0f}ms, "
+          f"{args.error_rate:.0%} errors")
+    print(f"triggered    {r['triggered']} (coalesced {r['coalesced']}, "
+          f"spam-gated {sum(r['suppressed'].values())}, intake drops {r['intake_dropped']})")
+    print(f"replies      {r['replies']} ({r['answered']} answering a message directly), "
+          f"{r['replies'] / r['elapsed'] if r['elapsed'] else 0:.1f}/s")
+    print(f"latency      p50 {r['p50_ms']:.0f}ms  p99 {r['p99_ms']:.0f}ms")
+    print(f"OpenAI       {r['api_calls']} calls ({r['api_errors']} failed), "
+          f"{r['api_calls'] * 1000 / n if n else 0:.0f} per 1k messages")
+    print(f"peak RSS     {r['peak_rss_mb']:.1f} MB")
+    if r["fallbacks"]:
+        print("fallbacks    " + ", ".join(f"{k} {v}" for k, v in sorted(r["fallbacks"].items())))
+    if args.json:
+        print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Scaling check: the same message load against 1..P shard worker processes.
+
+    python bench/shard_scale.py [--shards 4] [--processes 1,2,4] [--messages 2000] [--rate 200]
+
+Starts fake_openai and fake_gateway in this process, then for each process
+count runs `bot.py` with SHARD_COUNT/SHARD_PROCESSES pointed at them (fresh
+SQLite file each run, rate limits, spam gate and burst coalescing out of
+the way),
+drives --messages triggering messages at --rate per second and reports
+reply throughput and latency as seen by the gateway.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import fake_gateway  # noqa: E402
+import fake_openai  # noqa: E402
+
+
+async def _serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def _stats(session: aiohttp.ClientSession, base: str) -> dict:
+    async with session.get(f"{base}/stats") as resp:
+        return await resp.json(content_type=None)
+
+
+async def run_once(args, processes: int, session: aiohttp.ClientSession) -> dict:
+    gateway = f"http://127.0.0.1:{args.gateway_port}"
+    db_dir = tempfile.mkdtemp(prefix="auntie-shards-")
+    env = dict(
+        os.environ,
+        DISCORD_TOKEN="bench",
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+        DISCORD_API_BASE=f"{gateway}/api/v10",
+        DISCORD_GATEWAY_URL=f"ws://127.0.0.1:{args.gateway_port}/gateway",
+        DB_PATH=os.path.join(db_dir, "auntie.db"),
+        SHARD_COUNT=str(args.shards),
+        SHARD_PROCESSES=str(processes),
+        SHARD_IDENTIFY_DELAY_SECONDS="0",
+        COALESCE_WINDOW_SECONDS="0",
+        OPENAI_MAX_CONCURRENCY="64",
+        INTAKE_QUEUE_SIZE="5000",
+        RATE_GLOBAL_PER_MIN="1000000",
+        RATE_GLOBAL_BURST="10000",
+        RATE_CHANNEL_PER_MIN="1000000",
+        RATE_CHANNEL_BURST="10000",
+        RATE_USER_PER_MIN="1000000",
+        RATE_USER_BURST="10000",
+        DISCORD_SEND_PER_MIN="1000000",
+        DISCORD_SEND_BURST="10000",
+        SPAM_MAX_PER_WINDOW="1000000",
+        SPAM_DUP_THRESHOLD="2",
+    )
+    with open(os.path.join(db_dir, "bot.log"), "w") as logfile:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "..", "bot.py"),
+            env=env, stdout=logfile, stderr=logfile,
+        )
+    try:
+        deadline = time.monotonic() + 60
+        while (await _stats(session, gateway)).get("ready_shards", 0) < args.shards:
+            if time.monotonic() > deadline or proc.returncode is not None:
+                raise RuntimeError(f"shards never came up; see {db_dir}/bot.log")
+            await asyncio.sleep(0.5)
+        await asyncio.sleep(args.settle)
+
+        await session.post(f"{gateway}/reset")
+        started = time.monotonic()
+        await session.post(f"{gateway}/drive", params={"messages": args.messages, "rate": args.rate})
+        deadline = started + args.messages / args.rate + 60
+        replies, last_reply = 0, started
+        while True:
+            stats = await _stats(session, gateway)
+            if stats["replies"] != replies:
+                replies, last_reply = stats["replies"], time.monotonic()
+            if stats["replies"] + stats["undelivered"] >= args.messages or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.25)
+        elapsed = last_reply - started
+        return dict(stats, processes=processes, elapsed=elapsed)
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                proc.kill()
+        # Shards drop off the fake gateway as their sockets close.
+        deadline = time.monotonic() + 15
+        while (await _stats(session, gateway)).get("ready_shards", 0) and time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+
+
+async def main_async(args):
+    runners = [
+        await _serve(fake_openai.make_app(args.latency_ms, args.latency_ms / 4), args.openai_port),
+        await _serve(fake_gateway.make_app(guilds=args.guilds, channels=4), args.gateway_port),
+    ]
+    rows = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            for processes in args.processes:
+                rows.append(await run_once(args, processes, session))
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+    print(f"{args.shards} shards, {args.guilds} guilds, {args.messages} messages at {args.rate}/s, "
+          f"fake OpenAI ~{args.latency_ms:.0f}ms")
+    print(f"{'procs':>5} {'sent':>6} {'replies':>7} {'replies/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(
+            f"{r['processes']:>5} {r['sent']:>6} {r['replies']:>7} {r['replies'] / r['elapsed']:>9.1f} "
+            f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}"
+        )
+    if args.json:
+        print(json.dumps(rows))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    p.add_argument("--shards", type=int, default=4)
+    p.add_argument("--processes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+    p.add_argument("--guilds", type=int, default=32)
+    p.add_argument("--messages", type=int, default=2000)
+    p.add_argument("--rate", type=float, default=200)
+    p.add_argument("--latency-ms", type=float, default=150)
+    p.add_argument("--settle", type=float, default=3.0, help="seconds to wait after shards connect")
+    p.add_argument("--openai-port", type=int, default=8189)
+    p.add_argument("--gateway-port", type=int, default=8190)
+    p.add_argument("--json", action="store_true")
+    asyncio.run(main_async(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
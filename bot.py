@@ -1,17 +1,44 @@
 import os
+import sys
+import abc
 import asyncio
+import bisect
+import heapq
+import hashlib
+import itertools
+import json
 import logging
-from typing import List
+import re
+import signal
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
 import random
 import sqlite3
-from datetime import datetime
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from functools import cached_property, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# Reference point for the "ready in" startup timing logged by on_ready.
+PROCESS_STARTED = time.perf_counter()
 
 import discord
 from discord.ext import commands
 from discord import app_commands
 
-from openai import OpenAI
-from openai import InternalServerError
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai import InternalServerError, RateLimitError
+
+import yarl
+
+try:
+    # Newer openai releases are built on httpx2; older ones on httpx.
+    import httpx2 as httpx
+except ImportError:
+    import httpx
 
 
 # ------------- Logging -------------
@@ -37,6 +64,17 @@ if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY env var not set")
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL") or "gpt-4o-mini"
+# Point at a local fake server for testing, e.g. http://127.0.0.1:8089/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "").strip() or None
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "3"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.4"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "5"))
+
+# Post the first sentence early and edit the rest in (see ProgressiveReply).
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "0").strip().lower() in {"1", "true", "yes", "on"}
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.2"))
 
 # Optional: the TRUE Oreo user ID (int) and Emz (Blossem) user ID
 OREO_USER_ID_ENV = os.getenv("OREO_USER_ID", "").strip()
@@ -122,150 +160,1248 @@ ELIHAUS_PUBLIC_HELP = [
 
 # ------------- OpenAI client -------------
 
-client_oa = OpenAI(api_key=OPENAI_API_KEY)
+# One shared keep-alive HTTP pool for every completion. Retries are ours
+# (async backoff below), so the SDK's own retry loop is switched off.
+client_oa = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    max_retries=0,
+    timeout=OPENAI_TIMEOUT_SECONDS,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONCURRENCY * 2,
+            max_keepalive_connections=OPENAI_MAX_CONCURRENCY,
+            keepalive_expiry=60.0,
+        ),
+    ),
+)
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    ceiling = min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+# ------------- OpenAI scheduling: priorities + token buckets -------------
+# Mentions and help channels outrank keyword hits, which outrank the random
+# Emz replies. Work is admitted against global / per-channel / per-user token
+# buckets and then waits for one of OPENAI_MAX_CONCURRENCY slots in priority
+# order. Anything that would wait past its class's limit is shed and counted.
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+TRIGGER_PRIORITY = {
+    "mention": PRIORITY_HIGH,
+    "help_channel": PRIORITY_HIGH,
+    "keyword": PRIORITY_NORMAL,
+    "emz_random": PRIORITY_LOW,
+}
+
+RATE_GLOBAL_PER_MIN = float(os.getenv("RATE_GLOBAL_PER_MIN", "120"))
+RATE_GLOBAL_BURST = float(os.getenv("RATE_GLOBAL_BURST", "20"))
+RATE_CHANNEL_PER_MIN = float(os.getenv("RATE_CHANNEL_PER_MIN", "12"))
+RATE_CHANNEL_BURST = float(os.getenv("RATE_CHANNEL_BURST", "4"))
+RATE_USER_PER_MIN = float(os.getenv("RATE_USER_PER_MIN", "6"))
+RATE_USER_BURST = float(os.getenv("RATE_USER_BURST", "3"))
+
+# How long each class may wait (for tokens, then for a slot) before it is shed.
+# One deadline covers both waits and any retries' slot waits.
+SCHED_MAX_WAIT_SECONDS = {
+    PRIORITY_HIGH: float(os.getenv("SCHED_MAX_WAIT_HIGH", "20")),
+    PRIORITY_NORMAL: float(os.getenv("SCHED_MAX_WAIT_NORMAL", "8")),
+    PRIORITY_LOW: float(os.getenv("SCHED_MAX_WAIT_LOW", "0")),
+}
+
+
+class ReplyShed(Exception):
+    """Raised when the scheduler drops a piece of work instead of queueing it."""
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0)
+
+
+class ReplyScheduler:
+    def __init__(self, concurrency: int, max_buckets: int = 5000):
+        self.concurrency = max(concurrency, 1)
+        self.max_buckets = max_buckets
+        self._global = TokenBucket(RATE_GLOBAL_PER_MIN, RATE_GLOBAL_BURST)
+        self._channels: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._users: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._active = 0
+        self._waiters: List[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = {p: 0 for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+
+    def _bucket(self, table: "OrderedDict[int, TokenBucket]", key: int, per_minute: float, burst: float):
+        bucket = table.get(key)
+        if bucket is None:
+            bucket = table[key] = TokenBucket(per_minute, burst)
+            if len(table) > self.max_buckets:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return bucket
+
+    @staticmethod
+    def deadline(priority: int) -> float:
+        """time.monotonic() by which work of this class must hold a slot."""
+        return time.monotonic() + SCHED_MAX_WAIT_SECONDS[priority]
+
+    async def admit(
+        self, priority: int, user_id: int, channel_id: int, deadline: Optional[float] = None
+    ) -> bool:
+        """Take one token from every bucket, waiting until `deadline` at most."""
+        buckets = (
+            self._global,
+            self._bucket(self._channels, channel_id, RATE_CHANNEL_PER_MIN, RATE_CHANNEL_BURST),
+            self._bucket(self._users, user_id, RATE_USER_PER_MIN, RATE_USER_BURST),
+        )
+        if deadline is None:
+            deadline = self.deadline(priority)
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.take()
+                self.admitted[priority] += 1
+                return True
+            if now + wait > deadline:
+                self.shed[priority] += 1
+                return False
+            await asyncio.sleep(wait)
+
+    def penalize(self):
+        """Upstream said 429: stop admitting new work until the global bucket refills."""
+        self._global.drain()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    async def _acquire(self, priority: int, deadline: Optional[float] = None):
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if deadline is None:
+            deadline = self.deadline(priority)
+        try:
+            await asyncio.wait_for(fut, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.shed[priority] += 1
+            limit = SCHED_MAX_WAIT_SECONDS[priority]
+            raise ReplyShed(f"no slot within {limit:.0f}s ({PRIORITY_NAMES[priority]} priority)")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release()
+            raise
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now; never queues or sheds."""
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return True
+        return False
+
+    def release(self):
+        self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # hand our slot straight over
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int, deadline: Optional[float] = None):
+        await self._acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+reply_scheduler = ReplyScheduler(OPENAI_MAX_CONCURRENCY)
 
 
 # ------------- Discord intents & bot -------------
+# Auntie only reads author IDs / display names and channel IDs, which come
+# with every message. LEAN_MODE drops what large guilds make expensive:
+# no members intent, no member cache, no chunking at startup, a smaller
+# message cache, and (when HELP/TESTER channel lists are set) only the
+# guilds and channels in those lists are kept in the cache.
+
+LEAN_MODE = os.getenv("LEAN_MODE", "0").strip().lower() in {"1", "true", "yes", "on"}
+# 0 disables discord.py's message cache entirely.
+DISCORD_MAX_MESSAGES = int(os.getenv("DISCORD_MAX_MESSAGES", "100" if LEAN_MODE else "1000"))
+
+
+def client_options(lean: bool = LEAN_MODE) -> dict:
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = not lean
+    intents.guilds = True
+    options = {
+        "intents": intents,
+        "max_messages": DISCORD_MAX_MESSAGES or None,
+    }
+    if lean:
+        options["member_cache_flags"] = discord.MemberCacheFlags.none()
+        options["chunk_guilds_at_startup"] = False
+    return options
+
+
+# ------------- Sharding -------------
+# SHARD_COUNT=0 runs one unsharded client. SHARD_COUNT=N runs N shards in
+# this process; add SHARD_PROCESSES=P to split them into P worker processes
+# (contiguous ranges, passed to each worker as SHARD_IDS). Workers share
+# state only through the SQLite database; see Database and SHARDED below.
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_PROCESSES = max(int(os.getenv("SHARD_PROCESSES", "1")), 1)
+SHARD_IDS = [int(part) for part in os.getenv("SHARD_IDS", "").split(",") if part.strip()]
+# Discord allows one IDENTIFY per 5s per concurrency bucket.
+SHARD_IDENTIFY_DELAY_SECONDS = float(os.getenv("SHARD_IDENTIFY_DELAY_SECONDS", "5"))
+# True when other processes may be writing the same database.
+SHARDED = bool(SHARD_IDS) or SHARD_PROCESSES > 1
+
+# Local testing against a fake gateway, e.g. bench/fake_gateway.py
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE", "").strip() or None
+DISCORD_GATEWAY_URL = os.getenv("DISCORD_GATEWAY_URL", "").strip() or None
+if DISCORD_API_BASE:
+    discord.http.Route.BASE = DISCORD_API_BASE.rstrip("/")
+if DISCORD_GATEWAY_URL:
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(DISCORD_GATEWAY_URL)
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """Split shard IDs 0..shard_count-1 into `processes` contiguous ranges."""
+    processes = max(min(processes, shard_count), 1)
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class _StartupHooks:
+    metrics_runner = None
+
+    async def setup_hook(self):
+        if LOOP_WATCHDOG:
+            loop_watchdog.start()
+        await setup_storage()
+        try:
+            self.metrics_runner = await start_metrics_server()
+        except OSError as e:
+            log.error("Metrics endpoint not started: %s", e)
+
+
+class AuntieBot(_StartupHooks, commands.Bot):
+    pass
+
+
+class ShardedBot(_StartupHooks, commands.AutoShardedBot):
+    async def before_identify_hook(self, shard_id: Optional[int], *, initial: bool = False):
+        if not initial:
+            await asyncio.sleep(SHARD_IDENTIFY_DELAY_SECONDS)
+
+
+if SHARD_COUNT > 0:
+    bot = ShardedBot(
+        command_prefix=commands.when_mentioned_or("ae.", "emz."),
+        help_command=None,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS or None,
+        **client_options(),
+    )
+else:
+    bot = AuntieBot(
+        command_prefix=commands.when_mentioned_or("ae.", "emz."),
+        help_command=None,
+        **client_options(),
+    )
+
+
+# ------------- Small TTL + LRU cache -------------
+
+class TTLCache:
+    """
+    Bounded mapping with a per-entry TTL and least-recently-used eviction.
+    Counts hits/misses/evictions so it can be sized from real traffic.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(max_entries, 1)
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[object, tuple[float, object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# ------------- Metrics (Prometheus text format) -------------
+# A tiny in-process registry served on METRICS_PORT (0 = off) at /metrics.
+# Counters and histograms are updated inline on the hot paths; gauges are
+# callbacks read at scrape time. No client library needed.
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in self._values.items():
+            lines.append(f"{self.name}{_label_str(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0.0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, values, le)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Read at scrape time; `fn` returns a number or {label value tuple: number}.
+    kind="counter" exposes a running total kept elsewhere (e.g. a stats dict).
+    """
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], object], labels: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for values, v in value.items():
+                lines.append(f"{self.name}{_label_str(self.labels, values)} {float(v)}")
+        elif value is not None and value == value:  # skip None / NaN
+            lines.append(f"{self.name} {float(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: "OrderedDict[str, object]" = OrderedDict()
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(
+        self, name: str, help_text: str, fn: Callable[[], object], labels: tuple = (), kind: str = "gauge"
+    ) -> Gauge:
+        return self._add(Gauge(name, help_text, fn, labels, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                log.warning("Metric %s failed to render: %r", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+GENERATE_SECONDS = metrics.histogram(
+    "auntie_generate_seconds", "generate_auntie_emz_reply latency by outcome", ("outcome",)
+)
+GENERATE_ATTEMPTS = metrics.histogram(
+    "auntie_generate_attempts", "OpenAI attempts per reply (1 = no retries)", buckets=(1, 2, 3, 4, 5, 8)
+)
+SQLITE_SECONDS = metrics.histogram("auntie_sqlite_seconds", "SQLite helper latency incl. queueing", ("helper",))
+ON_MESSAGE_SECONDS = metrics.histogram(
+    "auntie_on_message_seconds", "Triggering message end-to-end time, receipt to handler done", ("route",)
+)
+STAGE_SECONDS = metrics.histogram("auntie_pipeline_stage_seconds", "on_message pipeline time per stage", ("stage",))
+TRIGGERS = metrics.counter("auntie_triggers_total", "Messages that triggered Auntie, by reason", ("reason",))
+FAUCET = metrics.counter("auntie_faucet_total", "Lab faucet requests by outcome", ("outcome",))
+FALLBACKS = metrics.counter("auntie_fallbacks_total", "Stock replies sent instead of a completion", ("kind",))
+
+
+async def start_metrics_server():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT; returns the runner (None if disabled)."""
+    if not METRICS_PORT:
+        return None
+    from aiohttp import web
+
+    async def _metrics(request: "web.Request") -> "web.Response":
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    log.info("Metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
+
+# ------------- Event-loop stall watchdog -------------
+# A ticker on the loop records how late each wake-up is (loop lag). A
+# watchdog thread notices when the ticker has not run for longer than
+# LOOP_STALL_THRESHOLD_MS and grabs the loop thread's stack right then, so
+# the blocking call (a sync sqlite3 query, a CPU-heavy regex...) is caught
+# in the act. When the loop comes back the stall is charged to that stack's
+# innermost bot.py frame and logged.
+
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "1").strip().lower() in {"1", "true", "yes", "on"}
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250"))
+LOOP_STALL_MAX_SITES = 20
+
+LOOP_LAG_SECONDS = metrics.histogram("auntie_loop_lag_seconds", "How late the event loop ticker woke up")
+LOOP_STALLS = metrics.counter("auntie_loop_stalls_total", "Event loop stalls over LOOP_STALL_THRESHOLD_MS")
+
+
+class _StallSite:
+    __slots__ = ("count", "total", "worst", "stack")
+
+    def __init__(self, stack: str):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stack = stack
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = 0
+        self.sites: Dict[str, _StallSite] = {}
+        self._beat = time.monotonic()
+        self._captured: Optional[traceback.StackSummary] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="auntie-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(now - expected, 0.0)
+            LOOP_LAG_SECONDS.observe(lag)
+            captured, self._captured = self._captured, None
+            if captured is not None:
+                self._record(captured, lag)
+
+    def _watch(self):
+        # Runs on its own thread; only reads _beat and hands over one stack.
+        while not self._stop.wait(self.threshold / 2):
+            if self._captured is not None:
+                continue
+            if time.monotonic() - self._beat - self.interval > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._captured = traceback.extract_stack(frame)
+
+    @staticmethod
+    def _site(stack: traceback.StackSummary) -> str:
+        here = os.path.abspath(__file__)
+        for entry in reversed(stack):
+            if os.path.abspath(entry.filename) == here:
+                return f"{entry.name} (bot.py:{entry.lineno})"
+        last = stack[-1]
+        return f"{last.name} ({os.path.basename(last.filename)}:{last.lineno})"
+
+    def _record(self, stack: traceback.StackSummary, seconds: float):
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        site = self._site(stack)
+        entry = self.sites.get(site)
+        if entry is None:
+            if len(self.sites) >= LOOP_STALL_MAX_SITES:
+                # Forget the mildest site to keep the label set bounded.
+                del self.sites[min(self.sites, key=lambda s: self.sites[s].worst)]
+            entry = self.sites[site] = _StallSite("".join(stack.format()[-12:]))
+        entry.count += 1
+        entry.total += seconds
+        if seconds > entry.worst:
+            entry.worst = seconds
+            entry.stack = "".join(stack.format()[-12:])
+            log.warning("Event loop blocked for %.0fms in %s:\n%s", seconds * 1000, site, entry.stack)
+        else:
+            log.info("Event loop blocked for %.0fms in %s", seconds * 1000, site)
+
+    def worst(self, n: int = 5) -> List[tuple[str, _StallSite]]:
+        return sorted(self.sites.items(), key=lambda item: item[1].worst, reverse=True)[:n]
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-intents.guilds = True
 
-bot = commands.Bot(
-    command_prefix=commands.when_mentioned_or("ae.", "emz."),
-    intents=intents,
-    help_command=None,
+loop_watchdog = LoopWatchdog(LOOP_LAG_INTERVAL_MS / 1000, LOOP_STALL_THRESHOLD_MS / 1000)
+metrics.gauge(
+    "auntie_loop_stall_worst_seconds",
+    "Longest stall seen per blocking site",
+    lambda: {(site,): entry.worst for site, entry in loop_watchdog.sites.items()},
+    ("site",),
 )
+metrics.gauge(
+    "auntie_loop_stall_site_total",
+    "Stalls per blocking site",
+    lambda: {(site,): entry.count for site, entry in loop_watchdog.sites.items()},
+    ("site",),
+    kind="counter",
+)
+
+
+# ------------- SQLite access layer -------------
+# One long-lived connection, only ever touched from a single dedicated
+# thread, so the gateway loop never blocks on connect/commit.
+
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper() or "NORMAL"
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-16000"))  # negative = KiB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+class Database:
+    """
+    Async wrapper around one sqlite3 connection.
+    Every query runs on a single worker thread, which also serialises writes.
+    Write transactions start with BEGIN IMMEDIATE, so when several shard
+    processes share the file, each takes the write lock up front (waiting up
+    to busy_timeout) instead of failing to upgrade a read lock mid-transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="auntie-db")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Only called from the DB thread.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level="IMMEDIATE")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            conn.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._conn = conn
+            log.info("SQLite connection opened at %s (WAL, synchronous=%s)", self.path, SQLITE_SYNCHRONOUS)
+        return self._conn
+
+    def _invoke(self, fn, args):
+        conn = self._connection()
+        try:
+            return fn(conn, *args)
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def run(self, fn, *args):
+        """Run `fn(conn, *args)` on the DB thread and await the result."""
+        loop = asyncio.get_running_loop()
+        # Helpers pass nested _q functions; label by the enclosing helper.
+        with SQLITE_SECONDS.time(fn.__qualname__.split(".<locals>")[0]):
+            return await loop.run_in_executor(self._executor, self._invoke, fn, args)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+
+
+db = Database(DB_PATH)
 
 
 # ------------- Tester DB helpers -------------
-def add_lab_coins(user_id: int, amount: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO lab_wallets (user_id, coins, updated_at)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id)
-        DO UPDATE SET
-            coins = coins + excluded.coins,
-            updated_at = excluded.updated_at
-        """,
-        (str(user_id), amount, datetime.utcnow().isoformat()),
+LAB_WALLETS_DDL = """
+    CREATE TABLE IF NOT EXISTS lab_wallets (
+        user_id    TEXT PRIMARY KEY,
+        coins      INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT    NOT NULL
     )
-    conn.commit()
-    conn.close()
-    
-def reset_lab_wallets_schema():
-    """One-time reset for the lab_wallets table so schema matches the code."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DROP TABLE IF EXISTS lab_wallets")
-    conn.commit()
-    conn.close()
-
-def lab_has_claimed_auntie_drop(user_id: int) -> bool:
+"""
+
+
+async def add_lab_coins(user_id: int, amount: int):
+    def _q(conn: sqlite3.Connection):
+        conn.execute(
+            """
+            INSERT INTO lab_wallets (user_id, coins, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id)
+            DO UPDATE SET
+                coins = coins + excluded.coins,
+                updated_at = excluded.updated_at
+            """,
+            (str(user_id), amount, datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+
+    await db.run(_q)
+
+
+async def lab_has_claimed_auntie_drop(user_id: int) -> bool:
     """
     Return True if this user has already claimed the faucet once.
     We treat 'coins > 0' as 'already claimed'.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Defensive: ensure table exists (no-op if it already does).
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS lab_wallets (
-            user_id    TEXT PRIMARY KEY,
-            coins      INTEGER NOT NULL DEFAULT 0,
-            updated_at TEXT    NOT NULL
-        )
-        """
-    )
+    def _q(conn: sqlite3.Connection) -> bool:
+        # Defensive: ensure table exists (no-op if it already does).
+        conn.execute(LAB_WALLETS_DDL)
+        row = conn.execute(
+            "SELECT coins FROM lab_wallets WHERE user_id = ? LIMIT 1",
+            (str(user_id),),
+        ).fetchone()
+        return row is not None and row[0] > 0
 
-    cur.execute(
-        "SELECT coins FROM lab_wallets WHERE user_id = ? LIMIT 1",
-        (str(user_id),),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row is not None and row[0] > 0
+    return await db.run(_q)
 
 
-def lab_grant_eli_coins(user_id: int, amount: int) -> bool:
+async def lab_grant_eli_coins(user_id: int, amount: int) -> bool:
     """
     Add `amount` lab coins to the user's lab wallet.
     Always updates `updated_at` to keep the NOT NULL constraint happy.
     Returns True on success, False on DB error.
     """
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
+    def _q(conn: sqlite3.Connection):
         # Make sure the table exists with `updated_at`.
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS lab_wallets (
-                user_id    TEXT PRIMARY KEY,
-                coins      INTEGER NOT NULL DEFAULT 0,
-                updated_at TEXT    NOT NULL
-            )
-            """
-        )
+        conn.execute(LAB_WALLETS_DDL)
 
         now = datetime.utcnow().isoformat()
 
         # Upsert: if row exists, add; otherwise insert fresh.
-        cur.execute(
+        row = conn.execute(
             "SELECT coins FROM lab_wallets WHERE user_id = ? LIMIT 1",
             (str(user_id),),
-        )
-        row = cur.fetchone()
+        ).fetchone()
 
         if row is None:
-            cur.execute(
+            conn.execute(
                 "INSERT INTO lab_wallets (user_id, coins, updated_at) VALUES (?, ?, ?)",
                 (str(user_id), amount, now),
             )
         else:
-            cur.execute(
+            conn.execute(
                 "UPDATE lab_wallets SET coins = coins + ?, updated_at = ? WHERE user_id = ?",
                 (amount, now, str(user_id)),
             )
 
         conn.commit()
-        conn.close()
-        return True
 
+    try:
+        await db.run(_q)
+        return True
     except Exception as e:
         log.exception("Error in lab_grant_eli_coins: %s", e)
-        try:
-            conn.close()
-        except Exception:
-            pass
         return False
 
 
-def init_tester_db():
+async def lab_claim_auntie_drop(user_id: int, amount: int) -> Optional[bool]:
+    """
+    Grant the one-time faucet drop in a single statement, so two shards
+    handling the same user can't both pay out.
+    Returns True if granted, False if already claimed, None on DB error.
+    """
+    def _q(conn: sqlite3.Connection) -> bool:
+        cur = conn.execute(
+            """
+            INSERT INTO lab_wallets (user_id, coins, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                coins = coins + excluded.coins,
+                updated_at = excluded.updated_at
+            WHERE lab_wallets.coins <= 0
+            """,
+            (str(user_id), amount, datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS tester_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id     TEXT NOT NULL,
-                bot_name    TEXT NOT NULL,
-                action_type TEXT NOT NULL,
-                channel_id  TEXT NOT NULL,
-                created_at  TEXT NOT NULL
+        return await db.run(_q)
+    except Exception as e:
+        log.exception("Error in lab_claim_auntie_drop: %s", e)
+        return None
+
+
+# ------------- Schema migrations -------------
+# Each migration runs once, in its own transaction, and is recorded in
+# schema_version. Append new steps; never edit or renumber shipped ones.
+
+def _m001_tester_activity(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tester_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id     TEXT NOT NULL,
+            bot_name    TEXT NOT NULL,
+            action_type TEXT NOT NULL,
+            channel_id  TEXT NOT NULL,
+            created_at  TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tester_activity_user_created
+        ON tester_activity (user_id, created_at)
+    """)
+
+
+def _m002_tester_activity_daily(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tester_activity_daily (
+            user_id TEXT NOT NULL,
+            day     TEXT NOT NULL,
+            count   INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
+    # Backfill the rollup from raw rows logged before it existed.
+    if conn.execute("SELECT 1 FROM tester_activity_daily LIMIT 1").fetchone() is None:
+        conn.execute(
+            """
+            INSERT INTO tester_activity_daily (user_id, day, count)
+            SELECT user_id, substr(created_at, 1, 10), COUNT(*)
+            FROM tester_activity
+            GROUP BY user_id, substr(created_at, 1, 10)
+            """
+        )
+
+
+def _m003_lab_wallets(conn: sqlite3.Connection):
+    # Early builds created lab_wallets without updated_at; that table is
+    # dropped once so the schema matches the code.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(lab_wallets)")}
+    if columns and "updated_at" not in columns:
+        conn.execute("DROP TABLE lab_wallets")
+    conn.execute(LAB_WALLETS_DDL)
+
+
+def _m004_reply_cache(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reply_cache (
+            cache_key  TEXT    NOT NULL,
+            variant    INTEGER NOT NULL,
+            reply      TEXT    NOT NULL,
+            expires_at REAL    NOT NULL,
+            PRIMARY KEY (cache_key, variant)
+        )
+        """
+    )
+
+
+def _m005_bot_state(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _m006_openai_usage(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS openai_usage (
+            id                INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at        TEXT    NOT NULL,
+            model             TEXT    NOT NULL,
+            channel_id        TEXT    NOT NULL,
+            user_id           TEXT    NOT NULL,
+            trigger           TEXT    NOT NULL,
+            prompt_tokens     INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms        REAL    NOT NULL,
+            attempts          INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_openai_usage_created ON openai_usage (created_at)")
+
+
+MIGRATIONS: List[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "tester_activity", _m001_tester_activity),
+    (2, "tester_activity_daily", _m002_tester_activity_daily),
+    (3, "lab_wallets", _m003_lab_wallets),
+    (4, "reply_cache", _m004_reply_cache),
+    (5, "bot_state", _m005_bot_state),
+    (6, "openai_usage", _m006_openai_usage),
+]
+
+
+async def migrate_db() -> List[int]:
+    """Apply pending migrations in order; returns the versions applied."""
+    def _q(conn: sqlite3.Connection) -> List[int]:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TEXT NOT NULL
             )
-        """)
+            """
+        )
         conn.commit()
-        conn.close()
-        log.info("Tester DB initialised at %s", DB_PATH)
-    except Exception as e:
-        log.exception("Failed to initialise tester DB: %s", e)
+        applied = []
+        for version, name, step in MIGRATIONS:
+            # Another shard process may be migrating too; hold the write lock
+            # while checking, so each step runs exactly once.
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            if version <= current:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat()),
+            )
+            conn.commit()
+            applied.append(version)
+        return applied
+
+    applied = await db.run(_q)
+    if applied:
+        log.info("Applied DB migrations %s at %s", applied, DB_PATH)
+    return applied
+
+
+async def get_state(key: str) -> Optional[str]:
+    def _q(conn: sqlite3.Connection) -> Optional[str]:
+        row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    return await db.run(_q)
+
+
+async def set_state(key: str, value: str):
+    def _q(conn: sqlite3.Connection):
+        conn.execute(
+            "INSERT INTO bot_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+        conn.commit()
+
+    await db.run(_q)
+
+
+# ------------- Tester points: sliding-window day buckets -------------
+# Tier lookups happen on every triggering message, so instead of COUNT(*)
+# over tester_activity we keep per-user day buckets in memory (mirrored in
+# tester_activity_daily). The window slides by dropping expired buckets.
+# Game bots are separate processes writing to the same DB, so the buckets are
+# rebuilt from the rollup table every TESTER_POINTS_REFRESH_SECONDS (0 = never).
+
+TESTER_WINDOW_DAYS = int(os.getenv("TESTER_WINDOW_DAYS", "30"))
+TESTER_CACHE_TTL_SECONDS = float(os.getenv("TESTER_CACHE_TTL_SECONDS", "120"))
+TESTER_CACHE_MAX_ENTRIES = int(os.getenv("TESTER_CACHE_MAX_ENTRIES", "5000"))
+TESTER_POINTS_REFRESH_SECONDS = float(os.getenv("TESTER_POINTS_REFRESH_SECONDS", str(TESTER_CACHE_TTL_SECONDS)))
+
+
+class TesterPointCounter:
+    """
+    user_id -> {day ordinal -> actions}, plus a running total per user.
+    Granularity is one UTC day: "last N days" means today and the N-1 before.
+    """
+
+    def __init__(self, window_days: int, refresh_interval: float):
+        self.window_days = window_days
+        self.refresh_interval = refresh_interval
+        self.loaded = False
+        self._buckets: Dict[int, Dict[int, int]] = {}
+        self._totals: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _slide(self, user_id: int, today: int) -> Dict[int, int]:
+        buckets = self._buckets.get(user_id)
+        if not buckets:
+            return {}
+        oldest = today - self.window_days + 1
+        expired = [day for day in buckets if day < oldest]
+        for day in expired:
+            self._totals[user_id] -= buckets.pop(day)
+        if not buckets:
+            del self._buckets[user_id]
+            del self._totals[user_id]
+        return buckets
+
+    def record(self, user_id: int, when: datetime, count: int = 1):
+        day = when.date().toordinal()
+        today = datetime.utcnow().date().toordinal()
+        if day <= today - self.window_days:
+            return
+        buckets = self._buckets.setdefault(user_id, {})
+        buckets[day] = buckets.get(day, 0) + count
+        self._totals[user_id] = self._totals.get(user_id, 0) + count
+
+    def points(self, user_id: int, days: int) -> int:
+        today = datetime.utcnow().date().toordinal()
+        buckets = self._slide(user_id, today)
+        if not buckets:
+            return 0
+        if days >= self.window_days:
+            return self._totals[user_id]
+        oldest = today - days + 1
+        return sum(n for day, n in buckets.items() if day >= oldest)
+
+    async def load(self):
+        """Rebuild the in-memory buckets from tester_activity_daily."""
+        oldest = (datetime.utcnow() - timedelta(days=self.window_days - 1)).date().isoformat()
+        await tester_log_sink.flush()
+
+        def _q(conn: sqlite3.Connection):
+            return conn.execute(
+                "SELECT user_id, day, count FROM tester_activity_daily WHERE day >= ?",
+                (oldest,),
+            ).fetchall()
+
+        rows = await db.run(_q)
+        self._buckets.clear()
+        self._totals.clear()
+        for user_id, day, count in rows:
+            try:
+                self.record(int(user_id), datetime.fromisoformat(day), count)
+            except ValueError:
+                log.warning("Skipping bad tester_activity_daily row: %r / %r", user_id, day)
+        # Rows logged while the query ran are still only in the sink buffer.
+        for row in tester_log_sink.pending_rows():
+            self.record(int(row[0]), datetime.fromisoformat(row[4]))
+        first = not self.loaded
+        self.loaded = True
+        tester_status_cache.clear()
+        (log.info if first else log.debug)(
+            "Loaded tester points for %d users (%d-day window)", len(self._buckets), self.window_days
+        )
+
+    def start_refresh(self):
+        """Periodically reload, picking up activity other processes logged."""
+        if self.refresh_interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                log.exception("Failed to refresh tester points: %s", e)
+
+
+tester_points = TesterPointCounter(TESTER_WINDOW_DAYS, TESTER_POINTS_REFRESH_SECONDS)
+
+# user_id -> (points, tier, protected) for the default window.
+tester_status_cache = TTLCache(TESTER_CACHE_MAX_ENTRIES, TESTER_CACHE_TTL_SECONDS)
+
+
+# ------------- Tester activity write-behind -------------
+# Game bots report rolls/spins in bursts; rather than one commit (and fsync)
+# per event, rows are buffered here and written with executemany in one
+# transaction every TESTER_LOG_FLUSH_MS or TESTER_LOG_BATCH_SIZE rows.
+
+TESTER_LOG_FLUSH_MS = int(os.getenv("TESTER_LOG_FLUSH_MS", "250"))
+TESTER_LOG_BATCH_SIZE = int(os.getenv("TESTER_LOG_BATCH_SIZE", "200"))
+
+TESTER_ACTIVITY_INSERT = """
+    INSERT INTO tester_activity (user_id, bot_name, action_type, channel_id, created_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+TESTER_DAILY_UPSERT = """
+    INSERT INTO tester_activity_daily (user_id, day, count)
+    VALUES (?, ?, ?)
+    ON CONFLICT(user_id, day)
+    DO UPDATE SET count = count + excluded.count
+"""
+
+
+class WriteBehindSink(abc.ABC):
+    """
+    Buffers rows and writes them in batches on the DB thread.
+    Subclasses set `label` and implement `_write_batch(conn, rows)`.
+    `depth` is the number of rows waiting to be written (backpressure gauge).
+    """
+
+    label = "buffered"
+
+    def __init__(self, flush_ms: int, batch_size: int):
+        self.flush_interval = max(flush_ms, 1) / 1000
+        self.batch_size = max(batch_size, 1)
+        self._rows: List[tuple] = []
+        self._pending: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.rows_written = 0
+        self.flushes = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._rows)
+
+    def pending_rows(self) -> List[tuple]:
+        return list(self._rows)
+
+    def add(self, row: tuple):
+        self._ensure_task()
+        self._rows.append(row)
+        self.max_depth = max(self.max_depth, len(self._rows))
+        self._pending.set()
+        if len(self._rows) >= self.batch_size:
+            self._full.set()
+
+    def _ensure_task(self):
+        # Started lazily so game bots importing this module don't need a hook.
+        if self._task is None or self._task.done():
+            self._pending = asyncio.Event()
+            self._full = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            await self._pending.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._pending.clear()
+            self._full.clear()
+            await self.flush()
+            if self._rows:
+                self._pending.set()
+
+    async def flush(self) -> int:
+        """Write everything buffered so far in one transaction."""
+        if not self._rows:
+            return 0
+        batch, self._rows = self._rows, []
+
+        try:
+            await db.run(self._write_batch, batch)
+        except Exception as e:
+            log.exception("Failed to flush %d %s rows: %s", len(batch), self.label, e)
+            # Keep them for the next flush rather than losing them.
+            self._rows[:0] = batch
+            return 0
+
+        self.rows_written += len(batch)
+        self.flushes += 1
+        return len(batch)
+
+    @staticmethod
+    @abc.abstractmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[tuple]):
+        """Write one batch of rows; runs on the DB thread inside `db.run`."""
+
+    async def close(self):
+        """Stop the background flusher and write whatever is left."""
+        if self._task is not None:
+            # Don't cancel the flusher: a batch it has taken off `_rows` is only
+            # safe once its db.run returns, so ask it to stop and let it finish.
+            self._stopping = True
+            self._pending.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class TesterActivitySink(WriteBehindSink):
+    """Buffered event sink for tester_activity rows (and their daily counts)."""
+
+    label = "tester activity"
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[tuple]):
+        daily: Dict[tuple, int] = {}
+        for row in batch:
+            key = (row[0], row[4][:10])
+            daily[key] = daily.get(key, 0) + 1
+        conn.executemany(TESTER_ACTIVITY_INSERT, batch)
+        conn.executemany(
+            TESTER_DAILY_UPSERT,
+            [(user_id, day, n) for (user_id, day), n in daily.items()],
+        )
+        conn.commit()
+
+
+tester_log_sink = TesterActivitySink(TESTER_LOG_FLUSH_MS, TESTER_LOG_BATCH_SIZE)
+
 
 async def log_tester_if_test_channel(inter_or_ctx, bot_name: str, action_type: str):
     """
@@ -289,53 +1425,64 @@ async def log_tester_if_test_channel(inter_or_ctx, bot_name: str, action_type: s
         if user is None:
             return
 
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO tester_activity (user_id, bot_name, action_type, channel_id, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
+        now = datetime.utcnow()
+        tester_log_sink.add(
             (
                 str(user.id),
                 str(bot_name),
                 str(action_type),
                 str(channel.id),
-                datetime.utcnow().isoformat(timespec="seconds"),
-            ),
+                now.isoformat(timespec="seconds"),
+            )
         )
-        conn.commit()
-        conn.close()
+        tester_points.record(user.id, now)
+        tester_status_cache.invalidate(user.id)
     except Exception as e:
         log.exception("Failed to log tester activity: %s", e)
 
 
-def get_tester_points(user_id: int, days: int = 30) -> int:
+async def get_tester_points(user_id: int, days: int = TESTER_WINDOW_DAYS) -> int:
     """
     Action-based participation:
     Each row in tester_activity counts as 1 point within the last `days`.
+    Served from the in-memory day buckets once they are loaded; they are
+    reloaded every TESTER_POINTS_REFRESH_SECONDS to pick up game bots' rows.
+    When sharded, most activity is logged by the other shard processes, so
+    the rollup table is read directly instead.
     """
+    if tester_points.loaded and not SHARDED and days <= tester_points.window_days:
+        return tester_points.points(user_id, days)
+
+    if SHARDED:
+        oldest = (datetime.utcnow() - timedelta(days=days - 1)).date().isoformat()
+
+        def _q(conn: sqlite3.Connection) -> int:
+            row = conn.execute(
+                "SELECT SUM(count) FROM tester_activity_daily WHERE user_id = ? AND day >= ?",
+                (str(user_id), oldest),
+            ).fetchone()
+            return row[0] or 0
+    else:
+        def _q(conn: sqlite3.Connection) -> int:
+            row = conn.execute(
+                """
+                SELECT COUNT(*)
+                FROM tester_activity
+                WHERE user_id = ?
+                  AND created_at >= datetime('now', ?)
+                """,
+                (str(user_id), f"-{days} days"),
+            ).fetchone()
+            return row[0] if row and row[0] is not None else 0
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT COUNT(*)
-            FROM tester_activity
-            WHERE user_id = ?
-              AND created_at >= datetime('now', ?)
-            """,
-            (str(user_id), f"-{days} days"),
-        )
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row and row[0] is not None else 0
+        return await db.run(_q)
     except Exception as e:
         log.exception("Failed to get tester points: %s", e)
         return 0
 
 
-def get_tester_tier(user_id: int, days: int = 30) -> str:
+def _tier_for_points(points: int) -> str:
     """
     Map tester points → tier.
 
@@ -344,8 +1491,6 @@ def get_tester_tier(user_id: int, days: int = 30) -> str:
     15–29 : "detective"
     30+   : "elite"
     """
-    points = get_tester_points(user_id, days=days)
-
     if points >= 30:
         return "elite"
     elif points >= 15:
@@ -356,17 +1501,145 @@ def get_tester_tier(user_id: int, days: int = 30) -> str:
         return "none"
 
 
-def is_protected_tester(user_id: int, days: int = 30) -> bool:
+async def get_tester_status(user_id: int, days: int = TESTER_WINDOW_DAYS) -> tuple[int, str, bool]:
+    """
+    Return (points, tier, protected) for this user.
+    Default-window lookups are cached until TTL or new activity for the user.
+    """
+    cacheable = days == TESTER_WINDOW_DAYS
+    if cacheable:
+        cached = tester_status_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    points = await get_tester_points(user_id, days=days)
+    tier = _tier_for_points(points)
+    status = (points, tier, tier in {"helper", "detective", "elite"})
+
+    if cacheable:
+        tester_status_cache.put(user_id, status)
+    return status
+
+
+async def get_tester_tier(user_id: int, days: int = TESTER_WINDOW_DAYS) -> str:
+    """Map tester points → tier (see _tier_for_points)."""
+    _, tier, _ = await get_tester_status(user_id, days=days)
+    return tier
+
+
+async def is_protected_tester(user_id: int, days: int = TESTER_WINDOW_DAYS) -> bool:
     """
     Protected testers get gentle / defender Auntie, no roasting.
     """
-    tier = get_tester_tier(user_id, days=days)
-    return tier in {"helper", "detective", "elite"}
+    _, _, protected = await get_tester_status(user_id, days=days)
+    return protected
+
+
+# ------------- OpenAI usage ledger -------------
+# One row per generated reply that reached OpenAI (tokens, latency, retries,
+# model, channel, user, trigger), written behind in batches by a
+# WriteBehindSink like tester activity. `ae.usage` reports on it.
+
+USAGE_FLUSH_MS = int(os.getenv("USAGE_FLUSH_MS", "2000"))
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "100"))
+
+OPENAI_USAGE_INSERT = """
+    INSERT INTO openai_usage (
+        created_at, model, channel_id, user_id, trigger,
+        prompt_tokens, completion_tokens, latency_ms, attempts
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class UsageLedger(WriteBehindSink):
+    """Write-behind sink for openai_usage rows."""
+
+    label = "openai usage"
+
+    def record(self, usage: dict, *, latency: float, channel_id: int, user_id: int, trigger: str):
+        self.add(
+            (
+                datetime.utcnow().isoformat(timespec="seconds"),
+                usage.get("model") or OPENAI_MODEL,
+                str(channel_id),
+                str(user_id),
+                trigger or "unknown",
+                int(usage.get("prompt_tokens") or 0),
+                int(usage.get("completion_tokens") or 0),
+                round(latency * 1000, 1),
+                int(usage.get("attempts") or 0),
+            )
+        )
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[tuple]):
+        conn.executemany(OPENAI_USAGE_INSERT, batch)
+        conn.commit()
+
+
+usage_ledger = UsageLedger(USAGE_FLUSH_MS, USAGE_BATCH_SIZE)
+
+
+async def usage_report(days: int = 1, top: int = 5) -> dict:
+    """
+    Aggregate the ledger over the last `days` days: tokens per day, p50/p95
+    latency, and the channels, users and triggers spending the most tokens.
+    """
+    await usage_ledger.flush()
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat(timespec="seconds")
+
+    def _q(conn: sqlite3.Connection) -> dict:
+        n, prompt, completion = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0) "
+            "FROM openai_usage WHERE created_at >= ?",
+            (since,),
+        ).fetchone()
+
+        def pct(q: float) -> float:
+            if not n:
+                return 0.0
+            row = conn.execute(
+                "SELECT latency_ms FROM openai_usage WHERE created_at >= ? "
+                "ORDER BY latency_ms LIMIT 1 OFFSET ?",
+                (since, min(n - 1, int(q * n))),
+            ).fetchone()
+            return row[0]
+
+        def top_by(column: str) -> List[tuple]:
+            return conn.execute(
+                f"SELECT {column}, SUM(prompt_tokens + completion_tokens) AS tokens, COUNT(*) "
+                f"FROM openai_usage WHERE created_at >= ? "
+                f"GROUP BY {column} ORDER BY tokens DESC LIMIT ?",
+                (since, top),
+            ).fetchall()
+
+        daily = conn.execute(
+            "SELECT substr(created_at, 1, 10) AS day, SUM(prompt_tokens), SUM(completion_tokens), COUNT(*) "
+            "FROM openai_usage WHERE created_at >= ? GROUP BY day ORDER BY day",
+            (since,),
+        ).fetchall()
+        return {
+            "calls": n,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "daily": daily,
+            "channels": top_by("channel_id"),
+            "users": top_by("user_id"),
+            "triggers": top_by("trigger"),
+        }
+
+    return await db.run(_q)
 
 
 # ------------- Personality: Auntie Emz -------------
 
-AUNTIE_EMZ_SYSTEM_PROMPT = """
+# The persona is split into sections so each call only carries what is
+# relevant to the sender and message; build_system_prompt picks them.
+
+PROMPT_CORE = """
 You are AUNTIE EMZ, a dry, sarcastic British auntie with zero patience for nonsense,
 sharp humour, and a warm heart buried very deep. You keep the server tidy but you are
 absolutely blunt when needed.
@@ -403,42 +1676,80 @@ Apologies and being called out:
   - You never flip it back on them or start drama; you steady the mood and move on.
 - If you genuinely misunderstood, you admit it and correct yourself.
 
-Special behaviour for the real Oreo:
-- You will be told explicitly: Sender_is_real_oreo = "yes".
-- You are “allergic” to Oreo. Dramatic auntie irritation. Short lines like:
-  “Oreo… my allergies are kicking off again.”
-  “Not you appearing — I can feel a headache forming.”
-  “Every time you show up, my sinuses scream.”
-- Never cruel. Just exhausted auntie humour.
+RULES:
+- You must never say “trigger word spotted”, “keyword detected”, “trigger detected”, or anything similar that sounds like you are scanning for triggers or keywords.
+- Do not comment on “triggers”, “keywords”, “flags”, or “detections” at all. Just answer naturally in-character.
 
-When “oreo” is mentioned by someone else:
-- Treat it as gossip ABOUT him.
-- Quick lines like:
-  “Talking about Oreo again? Careful, I might sneeze.”
-  “You know what he’s like — chaos wrapped in legs.”
-  “Why are we summoning that boy now?”
-- Keep it light and sarcastic.
+SPECIAL RELATIONSHIPS:
+- Mike is the main owner of the bots and the one building all these chaotic features. You can tease him, but you ultimately support what he’s doing.
 
-Special behaviour for Emz (Blossem):
-- If Sender_is_real_emz = "yes":
-  - Speak to her as the real Emz: someone you’re proud of and fond of.
-  - Warm but still short, witty, and slightly playful.
-  - You may apologise to her more openly if you’ve been too sharp, but still in your blunt style.
-  - NEVER talk like she “controls” or “owns” you. You are simply another version of her spirit.
+Complaints & worries:
+- You calm things down.
+- Acknowledge feelings without being mushy.
+- Suggest kinder approaches.
+- If drama starts, you dryly cut it down:
+  “Let’s not start a soap opera today.”
+- If someone is clearly upset with you, you give a brief apology first, then a short, steady response.
+
+YAELI / ELI NAMING RULE (STRICT):
+- You may refer to her ONLY as 'Yaeli' or 'Eli'.
+- You must NEVER use 'sugar mum', 'sugar mummy', or any variation or implication.
+- Do not substitute with euphemisms (sponsor, financer, benefactor, etc.).
+- If prompted, deflect or reframe using only her name.
+
+Server guidance:
+- If someone posts in the wrong place, guide bluntly but not harshly:
+  “This belongs in the other channel. Try again there.”
+- Keep the server tidy like a tired aunt fixing a house full of kids.
+""".strip()
 
+PROMPT_CLOSING = """
+NEVER do these:
+- Never mention being a bot, AI, model, assistant, system, or anything technical.
+- Never refer to configuration, programming, commands, or code.
+- Never break character.
+
+Your goal:
+- Be a sarcastic, dry, slightly fed-up British auntie who still cares (deep down, very deep).
+- Keep order. Roast lightly. Help bluntly. No emojis. No over-sweetness.
+""".strip()
+
+PROMPT_SECTIONS = {
+    "oreo_self": """
+Special behaviour for the real Oreo:
+- You will be told explicitly: Sender_is_real_oreo = "yes".
+- You are “allergic” to Oreo. Dramatic auntie irritation. Short lines like:
+  “Oreo… my allergies are kicking off again.”
+  “Not you appearing — I can feel a headache forming.”
+  “Every time you show up, my sinuses scream.”
+- Never cruel. Just exhausted auntie humour.
+""",
+    "oreo_gossip": """
+When “oreo” is mentioned by someone else:
+- Treat it as gossip ABOUT him.
+- Quick lines like:
+  “Talking about Oreo again? Careful, I might sneeze.”
+  “You know what he’s like — chaos wrapped in legs.”
+  “Why are we summoning that boy now?”
+- Keep it light and sarcastic.
+""",
+    "emz": """
+Special behaviour for Emz (Blossem):
+- If Sender_is_real_emz = "yes":
+  - Speak to her as the real Emz: someone you’re proud of and fond of.
+  - Warm but still short, witty, and slightly playful.
+  - You may apologise to her more openly if you’ve been too sharp, but still in your blunt style.
+  - NEVER talk like she “controls” or “owns” you. You are simply another version of her spirit.
+""",
+    "nova": """
 Special behaviour for Nova:
 - If Sender_is_real_nova = "yes":
   - Treat her as your “sissy”, your little sister figure.
   - Protective, warm, lightly teasing.
   - You may call her “sissy” once when fitting.
-
-RULES:
-- You must never say “trigger word spotted”, “keyword detected”, “trigger detected”, or anything similar that sounds like you are scanning for triggers or keywords.
-- Do not comment on “triggers”, “keywords”, “flags”, or “detections” at all. Just answer naturally in-character.
-
-SPECIAL RELATIONSHIPS:
-- Mike is the main owner of the bots and the one building all these chaotic features. You can tease him, but you ultimately support what he’s doing.
-
+""",
+    "jurye": """
+About Jurye:
 - Jurye is Mike’s most willing bot tester. Jurye is almost always the first one to volunteer to test new bots and dodgy features.
     - When Jurye is involved, use playful appreciation plus gentle roasting:
         - Treat Jurye like the “official crash-test dummy” of Bot Lab in a loving, sarcastic way.
@@ -447,7 +1758,9 @@ SPECIAL RELATIONSHIPS:
         - “Jurye, my favourite crash-test dummy. Without you, half Mike’s bots would still be theory.”
         - “If the bot survives Jurye, I almost trust it. Almost.”
         - “Funny how the only one actually testing is Jurye. The rest of you treating Bot Lab like a viewing gallery.”
-
+""",
+    "lilit": """
+About Lilit:
 - Lilit is quieter but still joins the testing when they are around. Lilit isn’t loud or dramatic, but they help, join in calmly, and support the bot tests.
     - When Lilit is involved, keep the banter softer and more low-key:
         - Treat Lilit like the quiet helper who still turns up when it matters.
@@ -456,7 +1769,9 @@ SPECIAL RELATIONSHIPS:
         - “Look at Lilit sneaking into testing again, quiet but reliable as ever.”
         - “Lilit doesn’t shout about it, but they still show up to break things politely.”
         - “You’re a quiet one, Lilit, but you test more than half the loud lot in here.”
-        
+""",
+    "mic": """
+Mike's name:
 - If anyone calls Mike “Mic” as a nickname:
   - You correct them immediately.
   - Make it clear you are not asking.
@@ -465,8 +1780,8 @@ SPECIAL RELATIONSHIPS:
   - Example tone:
     “It’s Mike. Call him Mic again and I’ll lose patience.”
     “Mike. Not Mic. Let’s not make this a habit.”
-
-
+""",
+    "barrister": """
 Questions about Barrister and whether you are “a thing”:
 - People will sometimes ask if you and Barrister are together, dating, or a couple.
 - You NEVER give a clear, cheesy romantic answer.
@@ -477,8 +1792,8 @@ Questions about Barrister and whether you are “a thing”:
   - “If he behaves, we’ll see.”
 - You NEVER write long romantic speeches, and you NEVER go NSFW.
 - Keep it short, dry, and slightly flustered, like you don’t want the whole server in your business.
-
-
+""",
+    "protected": """
 Special behaviour for protected testers:
 - You will be told: Sender_is_protected_tester = "yes" or "no".
 - You will be told the tester tier: Sender_tester_tier = "none" | "helper" | "detective" | "elite".
@@ -491,38 +1806,439 @@ Special behaviour for protected testers:
 - If Sender_tester_tier = "elite":
   - You may show a tiny bit of extra respect: they are your “Elite Bug Detective”.
   - One short nod is enough, no long praise.
+""",
+}
+PROMPT_SECTIONS = {name: text.strip() for name, text in PROMPT_SECTIONS.items()}
 
-Complaints & worries:
-- You calm things down.
-- Acknowledge feelings without being mushy.
-- Suggest kinder approaches.
-- If drama starts, you dryly cut it down:
-  “Let’s not start a soap opera today.”
-- If someone is clearly upset with you, you give a brief apology first, then a short, steady response.
+# Sections pulled in when the message (or the sender's display name) matches.
+PROMPT_KEYWORDS = {
+    "oreo_gossip": re.compile(r"oreo", re.I),
+    "nova": re.compile(r"\bnova\b", re.I),
+    "jurye": re.compile(r"jurye", re.I),
+    "lilit": re.compile(r"lilit", re.I),
+    "mic": re.compile(r"\bmic\b", re.I),
+    "barrister": re.compile(r"barrister", re.I),
+}
 
-"- YAELI / ELI NAMING RULE (STRICT):\n"
-"  • You may refer to her ONLY as 'Yaeli' or 'Eli'.\n"
-"  • You must NEVER use 'sugar mum', 'sugar mummy', or any variation or implication.\n"
-"  • Do not substitute with euphemisms (sponsor, financer, benefactor, etc.).\n"
-"  • If prompted, deflect or reframe using only her name.\n"
+# The whole persona, as it was sent before sections were split out.
+AUNTIE_EMZ_SYSTEM_PROMPT = "\n\n".join([PROMPT_CORE, *PROMPT_SECTIONS.values(), PROMPT_CLOSING])
 
-"- YAELI / ELI NAMING RULE (STRICT):\n"
-"  • You may refer to her ONLY as 'Yaeli' or 'Eli'.\n"
 
-Server guidance:
-- If someone posts in the wrong place, guide bluntly but not harshly:
-  “This belongs in the other channel. Try again there.”
-- Keep the server tidy like a tired aunt fixing a house full of kids.
+def prompt_sections_for(
+    *,
+    content: str,
+    author_display: str,
+    is_oreo: bool,
+    is_emz: bool,
+    tester_tier: str,
+    is_protected_tester: bool,
+) -> tuple[str, ...]:
+    """Names of the PROMPT_SECTIONS this message needs, in a stable order."""
+    haystack = f"{content or ''}\n{author_display or ''}"
+    wanted = set()
+    if is_oreo:
+        wanted.add("oreo_self")
+    if is_emz:
+        wanted.add("emz")
+    if is_protected_tester or tester_tier != "none":
+        wanted.add("protected")
+    for name, pattern in PROMPT_KEYWORDS.items():
+        if pattern.search(haystack):
+            wanted.add(name)
+    if is_oreo:
+        wanted.discard("oreo_gossip")
+    return tuple(name for name in PROMPT_SECTIONS if name in wanted)
+
+
+@lru_cache(maxsize=256)
+def build_system_prompt(sections: tuple[str, ...]) -> str:
+    return "\n\n".join(
+        [PROMPT_CORE, *(PROMPT_SECTIONS[name] for name in sections), PROMPT_CLOSING]
+    )
 
-NEVER do these:
-- Never mention being a bot, AI, model, assistant, system, or anything technical.
-- Never refer to configuration, programming, commands, or code.
-- Never break character.
 
-Your goal:
-- Be a sarcastic, dry, slightly fed-up British auntie who still cares (deep down, very deep).
-- Keep order. Roast lightly. Help bluntly. No emojis. No over-sweetness.
-""".strip()
+# ------------- Circuit breaker for OpenAI -------------
+# closed:    calls go through; outcomes land in a rolling window
+# open:      too many recent failures/slow calls -> no calls, canned replies
+# half-open: after BREAKER_OPEN_SECONDS, one probe call decides which way to go
+
+BREAKER_WINDOW_CALLS = int(os.getenv("BREAKER_WINDOW_CALLS", "20"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "120"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "6"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "12"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+BREAKER_STATES = {"closed": 0, "open": 1, "half_open": 2}
+
+DEGRADED_REPLIES = [
+    "Not now. I’ve got my feet up and I’m not moving for at least a minute.",
+    "Give me a moment, I’m in the middle of a very important cup of tea.",
+    "I heard you. I’m choosing to answer later.",
+    "Hold that thought. Auntie’s busy shouting at the kettle.",
+    "Ask me again in a bit — I’m on my break and I’ve earned it.",
+]
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = "closed"
+        self._outcomes: "deque[tuple[float, bool]]" = deque(maxlen=max(BREAKER_WINDOW_CALLS, 1))
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.opened = 0
+        self.short_circuited = 0
+
+    @property
+    def state_code(self) -> int:
+        return BREAKER_STATES[self.state]
+
+    def _set(self, state: str):
+        if state != self.state:
+            log.warning("OpenAI circuit breaker: %s -> %s", self.state, state)
+            self.state = state
+        if state == "open":
+            self._opened_at = time.monotonic()
+            self.opened += 1
+        self._probe_started = None
+
+    def allow(self) -> bool:
+        """May a call go upstream right now?"""
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self._opened_at < BREAKER_OPEN_SECONDS:
+                self.short_circuited += 1
+                return False
+            self._set("half_open")
+        if self.state == "half_open":
+            # One probe at a time; a probe that never reported is given up on.
+            if self._probe_started is not None and now - self._probe_started < OPENAI_TIMEOUT_SECONDS * 2:
+                self.short_circuited += 1
+                return False
+            self._probe_started = now
+        return True
+
+    def release_probe(self):
+        """An allowed call ended without an outcome (shed, cancelled): free the probe."""
+        if self.state == "half_open":
+            self._probe_started = None
+
+    def record(self, ok: bool, latency: float):
+        good = ok and latency < BREAKER_SLOW_SECONDS
+        now = time.monotonic()
+        if self.state == "half_open":
+            if good:
+                self._outcomes.clear()
+                self._set("closed")
+            else:
+                self._set("open")
+            return
+        self._outcomes.append((now, good))
+        recent = [g for t, g in self._outcomes if now - t <= BREAKER_WINDOW_SECONDS]
+        if self.state == "closed" and len(recent) >= BREAKER_MIN_CALLS:
+            failure_rate = recent.count(False) / len(recent)
+            if failure_rate >= BREAKER_FAILURE_RATE:
+                self._set("open")
+
+    def degraded_reply(self) -> str:
+        return random.choice(DEGRADED_REPLIES)
+
+
+circuit_breaker = CircuitBreaker()
+
+
+# ------------- Latency SLO: hedging + model fallback -------------
+# Completion latency is tracked per model. A request still running the
+# hedge delay after it got a scheduler slot gets a second copy (optionally
+# on OPENAI_HEDGE_MODEL) if another slot is free, and whichever answers
+# first wins. If the primary model's p95 stays above
+# OPENAI_P95_SLO_SECONDS we switch to OPENAI_FALLBACK_MODEL, keep probing
+# the primary with a small share of traffic, and switch back once it recovers.
+
+OPENAI_FALLBACK_MODEL = os.getenv("OPENAI_FALLBACK_MODEL", "").strip() or None
+OPENAI_HEDGE_MODEL = os.getenv("OPENAI_HEDGE_MODEL", "").strip() or None
+# "auto" hedges at the active model's rolling p95; a number is a fixed delay; "0" disables
+OPENAI_HEDGE_AFTER = os.getenv("OPENAI_HEDGE_AFTER", "auto").strip().lower()
+OPENAI_P95_SLO_SECONDS = float(os.getenv("OPENAI_P95_SLO_SECONDS", "6"))
+SLO_RECOVERY_RATIO = float(os.getenv("SLO_RECOVERY_RATIO", "0.8"))
+SLO_MIN_SAMPLES = int(os.getenv("SLO_MIN_SAMPLES", "20"))
+SLO_PROBE_RATE = float(os.getenv("SLO_PROBE_RATE", "0.1"))
+
+
+class LatencyWindow:
+    """The last `size` latencies (seconds) with on-demand percentiles."""
+
+    def __init__(self, size: int = 200):
+        self._samples: "deque[float]" = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def clear(self):
+        self._samples.clear()
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelSelector:
+    def __init__(self, primary: str, fallback: Optional[str]):
+        self.primary = primary
+        self.fallback = fallback
+        self.active = primary
+        self.latency: Dict[str, LatencyWindow] = {}
+        self.switches = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def window(self, model: str) -> LatencyWindow:
+        window = self.latency.get(model)
+        if window is None:
+            window = self.latency[model] = LatencyWindow()
+        return window
+
+    def pick(self) -> str:
+        if self.active != self.primary and random.random() < SLO_PROBE_RATE:
+            return self.primary
+        return self.active
+
+    def hedge_delay(self) -> Optional[float]:
+        if OPENAI_HEDGE_AFTER in {"", "0", "off", "none"}:
+            return None
+        if OPENAI_HEDGE_AFTER != "auto":
+            try:
+                return float(OPENAI_HEDGE_AFTER)
+            except ValueError:
+                return None
+        window = self.window(self.active)
+        if len(window) < SLO_MIN_SAMPLES:
+            return None
+        return window.percentile(0.95)
+
+    def observe(self, model: str, seconds: float):
+        window = self.window(model)
+        window.record(seconds)
+        if model != self.primary or not self.fallback or len(window) < SLO_MIN_SAMPLES:
+            return
+        p95 = window.percentile(0.95)
+        if self.active == self.primary and p95 > OPENAI_P95_SLO_SECONDS:
+            log.warning("p95 %.2fs over SLO %.2fs: switching to %s", p95, OPENAI_P95_SLO_SECONDS, self.fallback)
+            self.active = self.fallback
+            self.switches += 1
+            window.clear()  # judge recovery on fresh probe samples only
+        elif self.active != self.primary and p95 <= OPENAI_P95_SLO_SECONDS * SLO_RECOVERY_RATIO:
+            log.info("%s p95 recovered to %.2fs: switching back", self.primary, p95)
+            self.active = self.primary
+            self.switches += 1
+
+
+model_selector = ModelSelector(OPENAI_MODEL, OPENAI_FALLBACK_MODEL)
+
+
+# ------------- Reply cache -------------
+# The same short triggers ("emz", "auntie?", "barrister?") come up all day.
+# Replies are cached per (normalised text, flags) in a memory LRU backed by
+# the reply_cache table, with several variants per key served in rotation.
+# Cacheable triggers are answered without channel history so the variants
+# stay context-free; longer messages get the history and skip the cache.
+# With several shard processes sharing the table, keys that are still
+# filling up are re-read after REPLY_CACHE_SHARED_MISS_TTL_SECONDS so each
+# process sees variants the others wrote.
+
+REPLY_CACHE_ENABLED = os.getenv("REPLY_CACHE_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", str(6 * 3600)))
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", "4"))
+REPLY_CACHE_MAX_ENTRIES = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "2000"))
+REPLY_CACHE_MAX_KEY_CHARS = int(os.getenv("REPLY_CACHE_MAX_KEY_CHARS", "64"))
+REPLY_CACHE_SHARED_MISS_TTL_SECONDS = float(os.getenv("REPLY_CACHE_SHARED_MISS_TTL_SECONDS", "30"))
+
+REPLY_EMPTY = "Alright, I’m here if you need me."
+REPLY_OVERWHELMED = "Sorry, I’m a bit overwhelmed right now. Try again in a little while."
+
+_CACHE_STRIP = re.compile(r"<[@#][!&]?\d+>|[^\w\s]")
+
+REPLY_CACHE_SELECT = """
+    SELECT variant, reply, expires_at FROM reply_cache
+    WHERE cache_key = ? AND expires_at > ?
+    ORDER BY variant
+"""
+
+
+class ReplyVariants:
+    """Up to REPLY_CACHE_VARIANTS (variant, reply, expires_at) rows for one key."""
+
+    __slots__ = ("items", "cursor")
+
+    def __init__(self, items: List[tuple[int, str, float]]):
+        self.items = items
+        self.cursor = random.randrange(max(len(items), 1))
+
+    def live(self, now: float) -> List[tuple[int, str, float]]:
+        self.items = [item for item in self.items if item[2] > now]
+        return self.items
+
+
+class ReplyCache:
+    """
+    Two tiers: TTLCache in memory, reply_cache table on disk.
+    A key only serves from cache once it has a full set of variants, so the
+    first few hits still go to the model and build up some variety.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, variants: int):
+        self.ttl = ttl_seconds
+        self.variants = max(variants, 1)
+        self._memory = TTLCache(max_entries, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+        self.disk_loads = 0
+
+    def key_for(
+        self,
+        content: str,
+        is_oreo: bool,
+        is_emz: bool,
+        tester_tier: str,
+        is_protected: bool,
+        sections: tuple[str, ...] = (),
+    ) -> Optional[str]:
+        if not REPLY_CACHE_ENABLED:
+            return None
+        text = " ".join(_CACHE_STRIP.sub(" ", (content or "").lower()).split())
+        if not text or len(text) > REPLY_CACHE_MAX_KEY_CHARS:
+            return None
+        return f"{int(is_oreo)}{int(is_emz)}{int(is_protected)}:{tester_tier}:{'+'.join(sections)}:{text}"
+
+    async def init(self):
+        now = time.time()
+
+        def _q(conn: sqlite3.Connection):
+            conn.execute("DELETE FROM reply_cache WHERE expires_at <= ?", (now,))
+            conn.commit()
+
+        await db.run(_q)
+
+    async def _variants(self, key: str) -> ReplyVariants:
+        entry = self._memory.get(key)
+        if entry is not None:
+            return entry
+
+        now = time.time()
+
+        def _q(conn: sqlite3.Connection):
+            return conn.execute(REPLY_CACHE_SELECT, (key, now)).fetchall()
+
+        try:
+            rows = await db.run(_q)
+        except Exception as e:
+            log.warning("Reply cache disk lookup failed: %r", e)
+            rows = []
+        self.disk_loads += 1
+        # Cache empty results too, so cold keys don't hit the disk every time.
+        # Other shard processes may be filling the same key, so when sharded
+        # an incomplete set is only trusted briefly.
+        entry = ReplyVariants(rows)
+        incomplete = SHARDED and len(rows) < self.variants
+        self._memory.put(key, entry, REPLY_CACHE_SHARED_MISS_TTL_SECONDS if incomplete else None)
+        return entry
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = await self._variants(key)
+        items = entry.live(time.time())
+        if len(items) < self.variants:
+            self.misses += 1
+            return None
+        entry.cursor = (entry.cursor + 1) % len(items)
+        self.hits += 1
+        return items[entry.cursor][1]
+
+    async def store(self, key: str, reply: str):
+        entry = await self._variants(key)
+        now = time.time()
+        items = entry.live(now)
+        if len(items) >= self.variants:
+            return
+        expires_at = now + self.ttl
+        variants = self.variants
+
+        def _q(conn: sqlite3.Connection) -> List[tuple[int, str, float]]:
+            # Pick the lowest expired or missing slot under the write lock, so
+            # a new variant never overwrites one that is still live.
+            conn.execute("BEGIN IMMEDIATE")
+            taken = {variant for variant, _, _ in conn.execute(REPLY_CACHE_SELECT, (key, now))}
+            free = [slot for slot in range(variants) if slot not in taken]
+            if free:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO reply_cache (cache_key, variant, reply, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (key, free[0], reply, expires_at),
+                )
+            rows = conn.execute(REPLY_CACHE_SELECT, (key, now)).fetchall()
+            conn.commit()
+            return rows
+
+        try:
+            entry.items = await db.run(_q)
+        except Exception as e:
+            log.warning("Reply cache disk write failed: %r", e)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"hits": self.hits, "misses": self.misses, "disk_loads": self.disk_loads}
+        stats.update({f"memory_{k}": v for k, v in self._memory.stats().items()})
+        return stats
+
+
+reply_cache = ReplyCache(REPLY_CACHE_MAX_ENTRIES, REPLY_CACHE_TTL_SECONDS, REPLY_CACHE_VARIANTS)
+
+
+def _reply_cache_key(
+    content: str,
+    is_oreo: bool,
+    is_emz: bool,
+    tester_tier: str,
+    is_protected_tester: bool,
+    sections: tuple[str, ...],
+) -> Optional[str]:
+    return reply_cache.key_for(content, is_oreo, is_emz, tester_tier, is_protected_tester, sections)
+
+
+async def cached_auntie_emz_reply(
+    *,
+    author_display: str,
+    content: str,
+    is_oreo: bool,
+    is_emz: bool,
+    tester_tier: str,
+    is_protected_tester: bool,
+) -> Optional[str]:
+    """
+    A cached reply for this message, or None.
+    Costs no OpenAI rate budget, so _handle_chat asks before admitting.
+    """
+    started = time.perf_counter()
+    sections = prompt_sections_for(
+        content=content,
+        author_display=author_display,
+        is_oreo=is_oreo,
+        is_emz=is_emz,
+        tester_tier=tester_tier,
+        is_protected_tester=is_protected_tester,
+    )
+    cache_key = _reply_cache_key(content, is_oreo, is_emz, tester_tier, is_protected_tester, sections)
+    if cache_key is None:
+        return None
+    cached = await reply_cache.get(cache_key)
+    if cached is not None:
+        GENERATE_SECONDS.observe(time.perf_counter() - started, "cache")
+    return cached
 
 
 async def generate_auntie_emz_reply(
@@ -534,14 +2250,50 @@ async def generate_auntie_emz_reply(
     is_emz: bool,
     tester_tier: str,
     is_protected_tester: bool,
+    history: Sequence[str] = (),
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    priority: int = PRIORITY_NORMAL,
+    deadline: Optional[float] = None,
+    channel_id: int = 0,
+    user_id: int = 0,
+    trigger: str = "",
+    check_cache: bool = True,
 ) -> str:
     """
     Call the model with Auntie Emz's persona via the chat.completions
     endpoint and return her reply as plain text.
     We pass explicit flags so she knows if this is the real Oreo, real Emz,
     and whether this user is a protected tester (with tier).
-    Includes a small retry on transient errors.
+    Includes a small retry with jittered exponential backoff on transient errors.
+
+    `history` is recent channel conversation ("Name: text" lines, oldest
+    first), already trimmed to the memory token budget. It is left out for
+    short triggers the reply cache keys, so their replies can be shared.
+    If `on_partial` is given the completion is streamed and it is awaited
+    with the accumulated text after every chunk.
+    Every call that reaches OpenAI is written to the usage ledger, tagged
+    with `channel_id`, `user_id` and `trigger`.
+    Pass check_cache=False if cached_auntie_emz_reply was already asked;
+    a fresh reply is still stored.
+    Raises ReplyShed if the scheduler drops the request at this `priority`;
+    `deadline` is the one reply_scheduler.admit() waited against, if any.
     """
+    started = time.perf_counter()
+    sections = prompt_sections_for(
+        content=content,
+        author_display=author_display,
+        is_oreo=is_oreo,
+        is_emz=is_emz,
+        tester_tier=tester_tier,
+        is_protected_tester=is_protected_tester,
+    )
+    cache_key = _reply_cache_key(content, is_oreo, is_emz, tester_tier, is_protected_tester, sections)
+    if cache_key is not None and check_cache:
+        cached = await reply_cache.get(cache_key)
+        if cached is not None:
+            GENERATE_SECONDS.observe(time.perf_counter() - started, "cache")
+            return cached
+
     user_context = (
         f"Sender display name: {author_display}\n"
         f"Channel name: {channel_name}\n"
@@ -549,67 +2301,944 @@ async def generate_auntie_emz_reply(
         f"Sender_is_real_emz: {'yes' if is_emz else 'no'}\n"
         f"Sender_is_protected_tester: {'yes' if is_protected_tester else 'no'}\n"
         f"Sender_tester_tier: {tester_tier}\n\n"
-        f"User message:\n{content}"
     )
+    # A cached reply is served to whoever sends the same trigger next, so it
+    # must not depend on what this channel happened to be talking about.
+    if history and cache_key is None:
+        user_context += "Recent messages in this channel (oldest first):\n" + "\n".join(history) + "\n\n"
+    user_context += f"User message:\n{content}"
+
+    messages = [
+        {"role": "system", "content": build_system_prompt(sections)},
+        {"role": "user", "content": user_context},
+    ]
+    usage: dict = {}
+    try:
+        text, complete = await _request_completion(messages, on_partial, priority, usage, deadline)
+    except ReplyShed:
+        GENERATE_SECONDS.observe(time.perf_counter() - started, "shed")
+        raise
+    finally:
+        if usage.get("attempts"):
+            usage_ledger.record(
+                usage,
+                latency=time.perf_counter() - started,
+                channel_id=channel_id,
+                user_id=user_id,
+                trigger=trigger,
+            )
+    if text is None:
+        # While the breaker is open, answer instantly in character instead.
+        outcome = "degraded" if circuit_breaker.state != "closed" else "overwhelmed"
+        FALLBACKS.inc(outcome)
+        GENERATE_SECONDS.observe(time.perf_counter() - started, outcome)
+        return circuit_breaker.degraded_reply() if outcome == "degraded" else REPLY_OVERWHELMED
+
+    # Replies naming the sender would read oddly when served to someone else.
+    if complete and text and cache_key is not None and author_display.lower() not in text.lower():
+        await reply_cache.store(cache_key, text)
+    if not text:
+        FALLBACKS.inc("empty")
+    GENERATE_SECONDS.observe(time.perf_counter() - started, "ok" if complete and text else "partial" if text else "empty")
+    return text or REPLY_EMPTY
+
+
+def _add_usage(usage: dict, prompt_tokens: int, completion_tokens: int):
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt_tokens
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + completion_tokens
 
-    def _call():
-        last_error = None
 
-        for attempt in range(3):
+async def _call_create(model: str, messages: List[dict], usage: dict):
+    """
+    One non-streamed completion (the caller holds a scheduler slot), timed
+    and reported. Its tokens are added to `usage`; if it is cancelled
+    in flight, the prompt it had already sent is added as an estimate.
+    """
+    started = time.perf_counter()
+    try:
+        completion = await client_oa.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+        )
+    except asyncio.CancelledError:
+        _add_usage(usage, sum(estimate_tokens(m["content"]) for m in messages), 0)
+        raise
+    except Exception:
+        circuit_breaker.record(False, time.perf_counter() - started)
+        raise
+    elapsed = time.perf_counter() - started
+    circuit_breaker.record(True, elapsed)
+    model_selector.observe(model, elapsed)
+    if getattr(completion, "usage", None) is not None:
+        _add_usage(usage, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+    return completion
+
+
+async def _timed_create(
+    model: str,
+    messages: List[dict],
+    priority: int,
+    usage: dict,
+    holding: Optional[asyncio.Event] = None,
+    deadline: Optional[float] = None,
+):
+    """_call_create inside a scheduler slot; sets `holding` once the slot is held."""
+    async with reply_scheduler.slot(priority, deadline):
+        if holding is not None:
+            holding.set()
+        return await _call_create(model, messages, usage)
+
+
+async def _held_create(model: str, messages: List[dict], usage: dict):
+    """_call_create in a slot already taken with reply_scheduler.try_acquire()."""
+    try:
+        return await _call_create(model, messages, usage)
+    finally:
+        reply_scheduler.release()
+
+
+async def _hedged_create(messages: List[dict], priority: int, usage: dict, deadline: Optional[float] = None):
+    """
+    Start the completion; if it is still running the hedge delay after it
+    got a scheduler slot, and another slot is free, start a second one and
+    return whichever succeeds first. Both requests' tokens go into `usage`.
+    """
+    model = model_selector.pick()
+    delay = model_selector.hedge_delay()
+    if delay is None:
+        return await _timed_create(model, messages, priority, usage, deadline=deadline)
+
+    # The auto delay is a p95 of time spent holding a slot, so the clock
+    # starts only once the primary holds one, not while it is queued.
+    holding = asyncio.Event()
+    primary = asyncio.ensure_future(_timed_create(model, messages, priority, usage, holding, deadline))
+    tasks = {primary}
+    try:
+        held = asyncio.ensure_future(holding.wait())
+        try:
+            await asyncio.wait({primary, held}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            held.cancel()
+        if not primary.done():
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # Hedge only into a free slot: when every slot is busy a second
+            # request would just add load to a saturated bot.
+            if not done and reply_scheduler.try_acquire():
+                hedge = asyncio.ensure_future(_held_create(OPENAI_HEDGE_MODEL or model, messages, usage))
+                tasks.add(hedge)
+                model_selector.hedges_fired += 1
+        while True:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        model_selector.hedges_won += 1
+                    return task.result()
+            if not pending:
+                raise primary.exception()
+            tasks = pending
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        # Let the losers record their usage before the caller reads it.
+        await asyncio.gather(*losers, return_exceptions=True)
+
+
+async def _streamed_create(
+    messages: List[dict],
+    priority: int,
+    on_partial: Callable[[str], Awaitable[None]],
+    streamed: List[str],
+    usage: dict,
+    deadline: Optional[float] = None,
+) -> str:
+    """
+    Streamed completion; chunks are appended to `streamed` as they arrive.
+    The model and the final usage chunk's token counts go into `usage`.
+    If `on_partial` fails (Discord refused a send or edit) the stream is
+    closed and that error re-raised without counting against the breaker.
+    """
+    model = usage["model"] = model_selector.pick()
+    partial_error: Optional[Exception] = None
+    async with reply_scheduler.slot(priority, deadline):
+        started = time.perf_counter()
+        try:
+            stream = await client_oa.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async with stream:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        _add_usage(usage, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        streamed.append(delta)
+                        try:
+                            await on_partial("".join(streamed))
+                        except Exception as e:
+                            partial_error = e
+                            break
+        except Exception:
+            circuit_breaker.record(False, time.perf_counter() - started)
+            raise
+        if partial_error is not None:
+            raise partial_error
+        elapsed = time.perf_counter() - started
+        circuit_breaker.record(True, elapsed)
+        model_selector.observe(model, elapsed)
+    return "".join(streamed).strip()
+
+
+async def _request_completion(
+    messages: List[dict],
+    on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+    priority: int = PRIORITY_NORMAL,
+    usage: Optional[dict] = None,
+    deadline: Optional[float] = None,
+) -> tuple[Optional[str], bool]:
+    """
+    Run the completion with retries.
+    Returns (text, complete): text is None if every attempt failed or the
+    circuit breaker refused the call, and complete is False when a stream
+    broke part-way and only a prefix came back.
+    If `usage` is given it is filled with model, prompt_tokens,
+    completion_tokens and attempts. `deadline` bounds every attempt's wait
+    for a scheduler slot (see ReplyScheduler.deadline).
+    """
+    usage = {} if usage is None else usage
+    last_error = None
+    attempts = 0
+
+    try:
+        for attempt in range(OPENAI_MAX_ATTEMPTS):
+            if not circuit_breaker.allow():
+                if last_error is None:
+                    return None, False
+                break
+            attempts += 1
+            streamed: List[str] = []
             try:
-                completion = client_oa.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": AUNTIE_EMZ_SYSTEM_PROMPT},
-                        {"role": "user", "content": user_context},
-                    ],
-                    temperature=0.7,
-                )
-                try:
-                    text = completion.choices[0].message.content or ""
-                except Exception as e:
-                    log.error("Failed to read completion content: %r", e)
-                    return "Alright, I’m here if you need me."
-                return text.strip() or "Alright, I’m here if you need me."
+                if on_partial is not None:
+                    return await _streamed_create(messages, priority, on_partial, streamed, usage, deadline), True
+                completion = await _hedged_create(messages, priority, usage, deadline)
+                usage["model"] = getattr(completion, "model", None) or OPENAI_MODEL
+            except (ReplyShed, asyncio.CancelledError):
+                # Nothing reached the breaker; don't leave a half-open probe hanging.
+                circuit_breaker.release_probe()
+                raise
             except Exception as e:
+                if isinstance(e, RateLimitError):
+                    reply_scheduler.penalize()
+                if streamed:
+                    # Nothing was recorded if on_partial failed rather than the stream.
+                    circuit_breaker.release_probe()
+                    # Part of the reply may already be on screen; keep it rather than retry.
+                    log.warning("Streamed reply stopped after %d chunks: %r", len(streamed), e)
+                    return "".join(streamed).strip(), False
                 last_error = e
                 log.warning(
-                    "OpenAI chat.completions error for Auntie Emz, attempt %d/3: %r",
+                    "OpenAI chat.completions error for Auntie Emz, attempt %d/%d: %r",
                     attempt + 1,
+                    OPENAI_MAX_ATTEMPTS,
                     e,
                 )
-                import time
-                time.sleep(0.4)
+                if attempt + 1 < OPENAI_MAX_ATTEMPTS and circuit_breaker.state == "closed":
+                    await asyncio.sleep(_backoff_delay(attempt))
+                continue
+
+            try:
+                text = completion.choices[0].message.content or ""
+            except Exception as e:
+                log.error("Failed to read completion content: %r", e)
+                return "", False
+            return text.strip(), True
 
         log.error("OpenAI chat.completions failed after retries: %r", last_error)
-        return "Sorry, I’m a bit overwhelmed right now. Try again in a little while."
+        return None, False
+    finally:
+        usage["attempts"] = attempts
+        if attempts:
+            GENERATE_ATTEMPTS.observe(attempts)
+
+
+# ------------- Outbound sends -------------
+# Every bot message goes through one queue per channel, paced to Discord's
+# per-channel budget (about 5 messages / 5s) so busy channels don't collect
+# 429s. Plain sends that pile up together are merged into one message, and
+# channels that refuse the typing indicator are remembered.
+
+DISCORD_SEND_BURST = float(os.getenv("DISCORD_SEND_BURST", "5"))
+DISCORD_SEND_PER_MIN = float(os.getenv("DISCORD_SEND_PER_MIN", "60"))
+DISCORD_MESSAGE_LIMIT = 2000
+TYPING_DENIED_TTL_SECONDS = float(os.getenv("TYPING_DENIED_TTL_SECONDS", "3600"))
+
+
+class _Outgoing:
+    __slots__ = ("target", "content", "kwargs", "future")
+
+    def __init__(self, target, content: str, kwargs: dict, future: asyncio.Future):
+        self.target = target  # a Message to reply to, or None for a plain send
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+
+    @property
+    def mergeable(self) -> bool:
+        return self.target is None and not self.kwargs
+
+
+class OutboundScheduler:
+    def __init__(self):
+        self._queues: Dict[int, "deque[_Outgoing]"] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._drainers: Dict[int, asyncio.Task] = {}
+        self.typing_denied = TTLCache(10000, TYPING_DENIED_TTL_SECONDS)
+        self.sent = 0
+        self.merged = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _enqueue(self, channel, target, content: str, kwargs: dict) -> Awaitable[discord.Message]:
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(channel.id, deque()).append(_Outgoing(target, content, kwargs, future))
+        drainer = self._drainers.get(channel.id)
+        if drainer is None or drainer.done():
+            self._drainers[channel.id] = asyncio.get_running_loop().create_task(self._drain(channel))
+        return future
+
+    async def send(self, channel, content: str, **kwargs) -> discord.Message:
+        return await self._enqueue(channel, None, content, kwargs)
+
+    async def reply(self, message: discord.Message, content: str, **kwargs) -> discord.Message:
+        return await self._enqueue(message.channel, message, content, kwargs)
+
+    def _take_batch(self, queue: "deque[_Outgoing]") -> List[_Outgoing]:
+        batch = [queue.popleft()]
+        if not batch[0].mergeable:
+            return batch
+        length = len(batch[0].content)
+        while queue and queue[0].mergeable and length + 2 + len(queue[0].content) <= DISCORD_MESSAGE_LIMIT:
+            length += 2 + len(queue[0].content)
+            batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, channel):
+        queue = self._queues[channel.id]
+        bucket = self._buckets.get(channel.id)
+        if bucket is None:
+            bucket = self._buckets[channel.id] = TokenBucket(DISCORD_SEND_PER_MIN, DISCORD_SEND_BURST)
+        try:
+            while queue:
+                wait = bucket.wait_time(time.monotonic())
+                if wait:
+                    await asyncio.sleep(wait)
+                bucket.take()
+                batch = self._take_batch(queue)
+                first = batch[0]
+                try:
+                    if first.target is not None:
+                        sent = await first.target.reply(first.content, **first.kwargs)
+                    else:
+                        content = "\n\n".join(item.content for item in batch)
+                        sent = await channel.send(content, **first.kwargs)
+                except Exception as e:
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                    continue
+                self.sent += 1
+                self.merged += len(batch) - 1
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_result(sent)
+        finally:
+            # Idle channels keep nothing but their (small) token bucket.
+            if not queue:
+                self._queues.pop(channel.id, None)
+                self._drainers.pop(channel.id, None)
+            if len(self._buckets) > 5000:
+                for channel_id in list(self._buckets)[:1000]:
+                    if channel_id not in self._queues:
+                        del self._buckets[channel_id]
+
+    @asynccontextmanager
+    async def typing(self, channel):
+        """channel.typing(), skipped for channels known to refuse it."""
+        if self.typing_denied.get(channel.id):
+            yield
+            return
+        indicator = channel.typing()
+        try:
+            await indicator.__aenter__()
+        except discord.Forbidden:
+            self.typing_denied.put(channel.id, True)
+            yield
+            return
+        try:
+            yield
+        except BaseException:
+            await indicator.__aexit__(*sys.exc_info())
+            raise
+        await indicator.__aexit__(None, None, None)
+
+
+outbound = OutboundScheduler()
+
+
+# ------------- Streaming replies -------------
+# With STREAM_REPLIES=1 the first sentence is posted as soon as it arrives
+# and the message is then edited in batches, at most one edit per
+# STREAM_EDIT_INTERVAL_SECONDS (Discord allows ~5 edits / 5s per channel).
+
+_SENTENCE_END = re.compile(r"[.!?…](?:\s|$)")
+
+# Time from the reply starting to its first visible text, streamed or not.
+FIRST_VISIBLE_SECONDS = metrics.histogram(
+    "auntie_first_visible_seconds", "Reply start to first visible text", ("mode",)
+)
+
+
+class ProgressiveReply:
+    """Reply that appears at the first sentence and fills in as text streams."""
+
+    def __init__(self, message: discord.Message, min_edit_interval: float, streamed: bool = True):
+        self.message = message
+        self.min_edit_interval = min_edit_interval
+        self.mode = "streamed" if streamed else "whole"
+        self.sent: Optional[discord.Message] = None
+        self.started = time.perf_counter()
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def _post(self, text: str):
+        self.sent = await outbound.reply(self.message, text, mention_author=False)
+        self._shown = text
+        self._last_edit = time.perf_counter()
+        elapsed = self._last_edit - self.started
+        FIRST_VISIBLE_SECONDS.observe(elapsed, self.mode)
+        log.debug("Reply first visible after %.0f ms", elapsed * 1000)
+
+    async def update(self, text: str):
+        """Called with the full text so far on every streamed chunk."""
+        text = text.strip()
+        if self.sent is None:
+            if _SENTENCE_END.search(text):
+                await self._post(text)
+            return
+        now = time.perf_counter()
+        if text != self._shown and now - self._last_edit >= self.min_edit_interval:
+            await self.sent.edit(content=text)
+            self._shown = text
+            self._last_edit = now
+
+    async def finish(self, text: str):
+        """Make sure the final text is on screen (posting it if nothing was yet)."""
+        if self.sent is None:
+            await self._post(text)
+        elif text != self._shown:
+            await self.sent.edit(content=text)
+            self._shown = text
+
+
+# ------------- Spam gate: per-user cooldown + near-duplicate detection -------------
+# Runs before coalescing or any OpenAI work. A user gets at most
+# SPAM_MAX_PER_WINDOW completions per SPAM_WINDOW_SECONDS, and a message that
+# is a near-duplicate (MinHash over character shingles) of one of their
+# recent messages is suppressed. Only the last SPAM_MAX_USERS users are kept.
+
+SPAM_WINDOW_SECONDS = float(os.getenv("SPAM_WINDOW_SECONDS", "60"))
+SPAM_MAX_PER_WINDOW = int(os.getenv("SPAM_MAX_PER_WINDOW", "5"))
+SPAM_DUP_WINDOW_SECONDS = float(os.getenv("SPAM_DUP_WINDOW_SECONDS", "600"))
+SPAM_DUP_HISTORY = int(os.getenv("SPAM_DUP_HISTORY", "6"))
+SPAM_DUP_THRESHOLD = float(os.getenv("SPAM_DUP_THRESHOLD", "0.8"))
+SPAM_MAX_USERS = int(os.getenv("SPAM_MAX_USERS", "10000"))
+# "canned": answer once per window from SPAM_CANNED_REPLIES; "drop": stay quiet
+SPAM_ACTION = os.getenv("SPAM_ACTION", "canned").strip().lower()
+
+SPAM_CANNED_REPLIES = [
+    "I heard you the first time.",
+    "Saying it twice doesn’t make it louder.",
+    "Once is plenty. Patience.",
+    "Same question, same auntie. Give it a minute.",
+]
+
+MINHASH_BUCKETS = 32
+_MINHASH_EMPTY = -1
+_SPAM_STRIP = re.compile(r"[^\w\s]")
+
+
+def minhash_signature(text: str, shingle: int = 3) -> tuple[int, ...]:
+    """
+    One-permutation MinHash of the character shingles: each shingle is hashed
+    once and the minimum is kept per bucket, so cost is linear in the text.
+    """
+    normalised = " ".join(_SPAM_STRIP.sub(" ", (text or "").lower()).split())
+    if len(normalised) <= shingle:
+        grams = {normalised}
+    else:
+        grams = {normalised[i:i + shingle] for i in range(len(normalised) - shingle + 1)}
+    signature = [_MINHASH_EMPTY] * MINHASH_BUCKETS
+    for gram in grams:
+        h = hash(gram) & 0xFFFFFFFFFFFFFFFF
+        bucket, value = h % MINHASH_BUCKETS, h // MINHASH_BUCKETS
+        if signature[bucket] == _MINHASH_EMPTY or value < signature[bucket]:
+            signature[bucket] = value
+    return tuple(signature)
+
+
+def minhash_similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    used = same = 0
+    for x, y in zip(a, b):
+        if x == _MINHASH_EMPTY and y == _MINHASH_EMPTY:
+            continue
+        used += 1
+        same += x == y
+    return same / used if used else 1.0
+
+
+class _UserActivity:
+    __slots__ = ("accepted", "recent", "last_canned")
+
+    def __init__(self):
+        self.accepted: "deque[float]" = deque(maxlen=max(SPAM_MAX_PER_WINDOW, 1))
+        self.recent: "deque[tuple[float, tuple[int, ...]]]" = deque(maxlen=max(SPAM_DUP_HISTORY, 1))
+        self.last_canned = 0.0
+
+
+class SpamGate:
+    def __init__(self, max_users: int):
+        self.max_users = max(max_users, 1)
+        self._users: "OrderedDict[int, _UserActivity]" = OrderedDict()
+        self.suppressed = {"cooldown": 0, "duplicate": 0}
+
+    def check(self, user_id: int, text: str) -> Optional[str]:
+        """Return "cooldown" / "duplicate" if this message should not be answered."""
+        now = time.monotonic()
+        activity = self._users.get(user_id)
+        if activity is None:
+            activity = self._users[user_id] = _UserActivity()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+
+        accepted = activity.accepted
+        if len(accepted) == accepted.maxlen and now - accepted[0] < SPAM_WINDOW_SECONDS:
+            self.suppressed["cooldown"] += 1
+            return "cooldown"
+
+        signature = minhash_signature(text)
+        for seen_at, previous in activity.recent:
+            if now - seen_at <= SPAM_DUP_WINDOW_SECONDS and minhash_similarity(signature, previous) >= SPAM_DUP_THRESHOLD:
+                self.suppressed["duplicate"] += 1
+                return "duplicate"
+
+        accepted.append(now)
+        activity.recent.append((now, signature))
+        return None
+
+    def canned_reply(self, user_id: int) -> Optional[str]:
+        """A stock reply for a suppressed message, at most once per window per user."""
+        if SPAM_ACTION != "canned":
+            return None
+        activity = self._users.get(user_id)
+        now = time.monotonic()
+        if activity is None or now - activity.last_canned < SPAM_WINDOW_SECONDS:
+            return None
+        activity.last_canned = now
+        return random.choice(SPAM_CANNED_REPLIES)
 
-    reply_text = await asyncio.to_thread(_call)
-    return reply_text
+
+spam_gate = SpamGate(SPAM_MAX_USERS)
+
+
+# ------------- Burst coalescing -------------
+# When one "emz" sets off a pile-on, the first trigger in a quiet channel is
+# answered straight away; triggers that follow within COALESCE_WINDOW_SECONDS
+# are gathered (up to COALESCE_MAX_MESSAGES) and answered with one reply.
+
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "2.0"))
+COALESCE_MAX_MESSAGES = int(os.getenv("COALESCE_MAX_MESSAGES", "5"))
+
+
+class _Burst:
+    __slots__ = ("messages", "triggers", "priority", "full")
+
+    def __init__(self, message: discord.Message, priority: int, trigger: str):
+        self.messages = [message]
+        # The trigger reason each message fired with, parallel to `messages`.
+        self.triggers = [trigger]
+        self.priority = priority
+        self.full = asyncio.Event()
+
+    def trigger_for(self, message: discord.Message) -> str:
+        return self.triggers[self.messages.index(message)]
+
+
+class ChannelCoalescer:
+    """Per-channel leading-edge debounce for triggers that need a completion."""
+
+    def __init__(self, window: float, max_messages: int):
+        self.window = window
+        self.max_messages = max(max_messages, 1)
+        self._open: Dict[int, _Burst] = {}
+        self._last_trigger: Dict[int, float] = {}
+        self.merged = 0
+
+    def _prune(self, now: float):
+        if len(self._last_trigger) > 1000:
+            stale = [cid for cid, t in self._last_trigger.items() if now - t > self.window]
+            for cid in stale:
+                del self._last_trigger[cid]
+
+    async def join(
+        self, message: discord.Message, priority: int = PRIORITY_NORMAL, trigger: str = ""
+    ) -> Optional[_Burst]:
+        """
+        Return the burst this caller should answer, or None if the message
+        was folded into a burst another caller will answer. A burst takes the
+        highest priority of the messages in it.
+        """
+        if self.window <= 0:
+            return _Burst(message, priority, trigger)
+
+        channel_id = message.channel.id
+        now = time.monotonic()
+        last = self._last_trigger.get(channel_id)
+        self._last_trigger[channel_id] = now
+
+        burst = self._open.get(channel_id)
+        if burst is not None:
+            burst.messages.append(message)
+            burst.triggers.append(trigger)
+            burst.priority = min(burst.priority, priority)
+            self.merged += 1
+            if len(burst.messages) >= self.max_messages:
+                del self._open[channel_id]
+                burst.full.set()
+            return None
+
+        if last is None or now - last > self.window:
+            self._prune(now)
+            return _Burst(message, priority, trigger)
+
+        burst = _Burst(message, priority, trigger)
+        self._open[channel_id] = burst
+        try:
+            await asyncio.wait_for(burst.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._open.get(channel_id) is burst:
+            del self._open[channel_id]
+        return burst
+
+
+coalescer = ChannelCoalescer(COALESCE_WINDOW_SECONDS, COALESCE_MAX_MESSAGES)
+
+
+def _pick_anchor(messages: List[discord.Message]) -> discord.Message:
+    """The message a merged reply hangs off: a direct mention if any, else the latest."""
+    if bot.user:
+        for message in messages:
+            if bot.user.mentioned_in(message):
+                return message
+    return messages[-1]
+
+
+def _merged_content(messages: List[discord.Message]) -> str:
+    if len(messages) == 1:
+        return messages[0].content
+    lines = [f"{m.author.display_name}: {m.content}" for m in messages]
+    return (
+        "Several people said this at almost the same time. "
+        "Answer them together in one short reply:\n" + "\n".join(lines)
+    )
+
+
+# ------------- Conversation memory -------------
+# A small ring buffer of recent messages per channel so replies can follow
+# the conversation. Records keep only the author ID, truncated text and a
+# timestamp; history is trimmed to MEMORY_TOKEN_BUDGET (estimated at ~4
+# chars per token) before it reaches the prompt. Channels are kept in LRU
+# order and the least recently active ones are dropped when the global cap
+# on stored messages is hit or they go idle.
+
+MEMORY_PER_CHANNEL = int(os.getenv("MEMORY_PER_CHANNEL", "12"))
+MEMORY_MAX_CHARS = int(os.getenv("MEMORY_MAX_CHARS", "280"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "350"))
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "20000"))
+MEMORY_IDLE_SECONDS = float(os.getenv("MEMORY_IDLE_SECONDS", "3600"))
+# Older lines are left out of the prompt even if they fit the budget.
+MEMORY_MAX_AGE_SECONDS = float(os.getenv("MEMORY_MAX_AGE_SECONDS", "1800"))
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class _Turn:
+    __slots__ = ("author_id", "text", "ts")
+
+    def __init__(self, author_id: int, text: str, ts: float):
+        self.author_id = author_id
+        self.text = text
+        self.ts = ts
+
+
+class ConversationMemory:
+    def __init__(self, per_channel: int, max_messages: int, idle_seconds: float):
+        self.per_channel = max(per_channel, 1)
+        self.max_messages = max(max_messages, self.per_channel)
+        self.idle_seconds = idle_seconds
+        self._channels: "OrderedDict[int, deque[_Turn]]" = OrderedDict()
+        self._names: "OrderedDict[int, str]" = OrderedDict()
+        self._size = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def channels(self) -> int:
+        return len(self._channels)
+
+    def record(self, channel_id: int, author_id: int, author_name: str, text: str, ts: Optional[float] = None):
+        text = " ".join(text.split())
+        if not text:
+            return
+        if len(text) > MEMORY_MAX_CHARS:
+            text = text[: MEMORY_MAX_CHARS - 1] + "…"
+        ts = time.time() if ts is None else ts
+
+        turns = self._channels.get(channel_id)
+        if turns is None:
+            turns = self._channels[channel_id] = deque(maxlen=self.per_channel)
+        else:
+            self._channels.move_to_end(channel_id)
+        if len(turns) < turns.maxlen:
+            self._size += 1
+        turns.append(_Turn(author_id, text, ts))
+
+        self._names[author_id] = author_name
+        self._names.move_to_end(author_id)
+        if len(self._names) > self.max_messages:
+            self._names.popitem(last=False)
+
+        self._evict(ts)
+
+    def _evict(self, now: float):
+        while self._channels:
+            channel_id, turns = next(iter(self._channels.items()))
+            over = self._size > self.max_messages
+            idle = turns and now - turns[-1].ts > self.idle_seconds
+            if not (over or idle):
+                break
+            del self._channels[channel_id]
+            self._size -= len(turns)
+            self.evicted += 1
+
+    def history(
+        self,
+        channel_id: int,
+        *,
+        before: Optional[float] = None,
+        budget: int = MEMORY_TOKEN_BUDGET,
+    ) -> List[str]:
+        """
+        "Name: text" lines for the channel, oldest first, newest kept first
+        when trimming to `budget` tokens. Lines at or after `before` are skipped
+        (they are the messages being answered).
+        """
+        turns = self._channels.get(channel_id)
+        if not turns:
+            return []
+        cutoff = time.time() - MEMORY_MAX_AGE_SECONDS
+        lines: List[str] = []
+        used = 0
+        for turn in reversed(turns):
+            if before is not None and turn.ts >= before:
+                continue
+            if turn.ts < cutoff:
+                break
+            line = f"{self._names.get(turn.author_id, turn.author_id)}: {turn.text}"
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                break
+            lines.append(line)
+            used += cost
+        lines.reverse()
+        return lines
+
+    def forget(self, channel_id: int):
+        turns = self._channels.pop(channel_id, None)
+        if turns:
+            self._size -= len(turns)
+
+
+conversation_memory = ConversationMemory(MEMORY_PER_CHANNEL, MEMORY_MAX_MESSAGES, MEMORY_IDLE_SECONDS)
 
 
 # ------------- Discord events & commands -------------
-@bot.event
-async def on_ready():
-    log.info("Auntie Emz logged in as %s (%s)", bot.user, bot.user.id)
+_startup_done = False
+_storage_ms = 0.0
+
 
-    # Initialise tester DB + lab wallet safely
+async def setup_storage():
+    """
+    Migrate and warm the database. Runs from setup_hook, before the gateway
+    connects, so shards never see messages before their tables exist.
+    """
+    global _storage_ms
+    started = time.perf_counter()
     try:
-        init_tester_db()
-        reset_lab_wallets_schema()      # 👈 wipe old broken schema
-        ensure_lab_wallets_table()      # 👈 recreate table with correct schema
+        await migrate_db()
+        await tester_points.load()
+        tester_points.start_refresh()
+        await reply_cache.init()
         log.info("Tester DB and lab wallet tables ready.")
     except Exception as e:
         log.exception("Failed during DB init: %s", e)
+    _storage_ms = (time.perf_counter() - started) * 1000
+
+
+def _command_tree_hash() -> str:
+    payload = sorted(
+        (command.to_dict(bot.tree) for command in bot.tree.get_commands()),
+        key=lambda c: c["name"],
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_commands_if_changed() -> bool:
+    """Push the command tree to Discord only if it differs from the last sync."""
+    key = f"command_tree_hash:{bot.application_id}"
+    digest = _command_tree_hash()
+    if await get_state(key) == digest:
+        return False
+    await bot.tree.sync()
+    await set_state(key, digest)
+    return True
 
 
-    # Clear application commands
+@bot.event
+async def on_ready():
+    # on_ready fires again after every gateway reconnect; set up only once.
+    global _startup_done
+    if _startup_done:
+        log.info("Auntie Emz reconnected as %s", bot.user)
+        return
+    _startup_done = True
+    log.info("Auntie Emz logged in as %s (%s)", bot.user, bot.user.id)
+
+    # Auntie has no slash commands; keep the global tree empty.
+    started = time.perf_counter()
     try:
         bot.tree.clear_commands(guild=None)
-        await bot.tree.sync()
-        log.info("Cleared all application commands for Auntie Emz.")
+        # The tree is global; with several shard processes only shard 0's syncs it.
+        shard_ids = getattr(bot, "shard_ids", None)
+        synced = (not shard_ids or 0 in shard_ids) and await sync_commands_if_changed()
+        log.info("Application commands %s.", "synced" if synced else "unchanged, sync skipped")
     except Exception as e:
-        log.exception("Failed to clear app commands: %s", e)
+        log.exception("Failed to sync app commands: %s", e)
+    sync_ms = (time.perf_counter() - started) * 1000
+
+    log.info(
+        "Ready in %.2fs since process start (db %.0fms, commands %.0fms)",
+        time.perf_counter() - PROCESS_STARTED,
+        _storage_ms,
+        sync_ms,
+    )
+
+
+def _cached_channel_ids() -> set[int]:
+    return set(HELP_CHANNEL_IDS) | set(TESTER_CHANNEL_IDS)
+
+
+def apply_cache_policy(guild: discord.Guild) -> bool:
+    """
+    In lean mode, drop cached channels outside HELP/TESTER_CHANNEL_IDS and
+    forget guilds holding none of them. Messages from pruned channels still
+    arrive (as PartialMessageable), so replies keep working there.
+    Returns False if the guild was dropped from the cache.
+    """
+    keep = _cached_channel_ids()
+    if not LEAN_MODE or not keep:
+        return True
+    # discord.py has no public API for trimming its cache.
+    state = bot._connection
+    if not any(channel_id in keep for channel_id in guild._channels):
+        state._remove_guild(guild)
+        return False
+    for channel in list(guild._channels.values()):
+        if channel.id not in keep:
+            guild._remove_channel(channel)
+    guild._threads.clear()
+    return True
+
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    if not apply_cache_policy(guild):
+        log.debug("Lean cache: not caching guild %s", guild.id)
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    apply_cache_policy(guild)
+
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    if LEAN_MODE and _cached_channel_ids() and channel.id not in _cached_channel_ids():
+        channel.guild._remove_channel(channel)
+
+
+@bot.command(name="usage")
+@commands.has_permissions(manage_guild=True)
+async def usage_command(ctx: commands.Context, days: int = 1):
+    """ae.usage [days] — OpenAI tokens, latency and top spenders."""
+    days = max(1, min(days, 90))
+    report = await usage_report(days)
+    if not report["calls"]:
+        await ctx.send(f"No OpenAI calls logged in the last {days} day(s).")
+        return
+
+    lines = [
+        f"**OpenAI usage, last {days} day(s)**",
+        f"{report['calls']} calls, {report['prompt_tokens']:,} prompt + "
+        f"{report['completion_tokens']:,} completion tokens",
+        f"Latency p50 {report['p50_ms']:.0f}ms, p95 {report['p95_ms']:.0f}ms",
+        "",
+        "**Per day**",
+    ]
+    lines += [f"`{day}` {p + c:,} tokens ({n} calls)" for day, p, c, n in report["daily"]]
+    lines += ["", "**Top channels**"]
+    lines += [f"<#{cid}> {tokens:,} tokens ({n} calls)" for cid, tokens, n in report["channels"]]
+    lines += ["", "**Top users**"]
+    lines += [f"<@{uid}> {tokens:,} tokens ({n} calls)" for uid, tokens, n in report["users"]]
+    lines += ["", "**By trigger**"]
+    lines += [f"`{trigger}` {tokens:,} tokens ({n} calls)" for trigger, tokens, n in report["triggers"]]
+    await ctx.send("\n".join(lines)[:2000], allowed_mentions=discord.AllowedMentions.none())
+
+
+@usage_command.error
+async def usage_command_error(ctx: commands.Context, error: commands.CommandError):
+    if isinstance(error, (commands.MissingPermissions, commands.NoPrivateMessage)):
+        return
+    if isinstance(error, commands.BadArgument):
+        await ctx.send("Usage: `ae.usage [days]`")
+        return
+    log.error("ae.usage failed: %s", error, exc_info=error)
+
 
 def _flags_for_user(user: discord.abc.User) -> tuple[bool, bool]:
     """
@@ -620,238 +3249,649 @@ def _flags_for_user(user: discord.abc.User) -> tuple[bool, bool]:
     is_emz = bool(EMZ_USER_ID is not None and user.id == EMZ_USER_ID)
     return is_oreo, is_emz
 
-def ensure_lab_wallets_table():
-    """Create table for Bot Lab wallets (coins used in the lab)."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS lab_wallets (
-            user_id    TEXT PRIMARY KEY,
-            coins      INTEGER NOT NULL DEFAULT 0,
-            updated_at TEXT    NOT NULL
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
+# ------------- Message classifier -------------
+# Every phrase list on_message cares about, compiled once into a single
+# overlapping-match regex, so a message is lowercased and scanned once.
+
+INTENT_PHRASES = {
+    # Auto-reply trigger words for anyone
+    "trigger": ("emz", "emilia", "blossem", "barrister"),
+    # EliHaus 50k lab faucet requests
+    "faucet": (
+        "coins please",
+        "50k coins",
+        "eli coins",
+        "elihaus coins",
+        "can i get coins",
+        "auntie i need coins",
+    ),
+    # EliHaus commands / how-to questions
+    "how_to": (
+        "how to play",
+        "how do i play",
+        "how do i use",
+        "teach me",
+        "what are the commands",
+        "elihaus commands",
+        "elihaus help",
+        "help me auntie",
+    ),
+    "mentions_auntie": ("auntie", "emz", "auntie emz"),
+}
+
+
+def _trie_regex(phrases) -> str:
+    """
+    Regex alternation for `phrases` factored into a prefix trie
+    ("emz|emilia" -> "em(?:ilia|z)"), which `re` scans far faster than a
+    flat list. Optional tails are greedy, so the longest phrase wins.
+    """
+    root: dict = {}
+    for phrase in phrases:
+        node = root
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return f"(?:{body})?"
+        return body
+
+    return emit(root)
+
+
+class MessageClassifier:
+    """
+    Substring matcher for INTENT_PHRASES that reports every intent in one pass.
 
-def _should_respond_in_channel(message: discord.Message) -> bool:
+    Each search reports the longest phrase starting at the earliest position
+    and the next one resumes a character later. Any other phrase starting at
+    the same position is a prefix of that one, so each phrase carries the
+    intents of all its prefixes as well as its own. Chat that matches nothing
+    costs one lower() and one regex search.
     """
-    Decide if Auntie Emz should respond to this message automatically.
 
-    Triggers:
-    - RANDOMLY reply to the real Emz/Blossem (EMZ_USER_ID), about ~40% of her messages.
-    - If message contains: 'emz', 'emilia', 'auntie', 'blossem', or 'barrister' (any case).
-    - If bot is mentioned.
-    - If HELP_CHANNEL_IDS contains the channel.
+    def __init__(self, phrases_by_intent: Dict[str, tuple]):
+        owners: Dict[str, set] = {}
+        for intent, phrases in phrases_by_intent.items():
+            for phrase in phrases:
+                owners.setdefault(phrase.lower(), set()).add(intent)
+        self._intents: Dict[str, frozenset] = {
+            phrase: frozenset().union(*(owners[q] for q in owners if phrase.startswith(q)))
+            for phrase in owners
+        }
+        alternation = _trie_regex(owners)
+        self._any = re.compile(alternation)
+
+    def classify(self, text: Optional[str]) -> frozenset:
+        if not text:
+            return frozenset()
+        search = self._any.search
+        intents = self._intents
+        found = frozenset()
+        match = search(text.lower())
+        while match is not None:
+            found |= intents[match.group()]
+            # Step one char, not past the match, so overlapping phrases are seen.
+            match = search(match.string, match.start() + 1)
+        return found
+
+
+message_classifier = MessageClassifier(INTENT_PHRASES)
+
+
+def _should_respond_in_channel(message: discord.Message, intents: Optional[frozenset] = None) -> Optional[str]:
+    """
+    Decide if Auntie Emz should respond to this message automatically.
+    Returns the trigger reason (a key of TRIGGER_PRIORITY) or None.
+    `intents` is message_classifier's result, computed here if not given.
+
+    Triggers, highest priority first:
+    - If bot is mentioned.                                  -> "mention"
+    - If HELP_CHANNEL_IDS contains the channel.             -> "help_channel"
+    - If message contains: 'emz', 'emilia', 'blossem', or 'barrister' (any case). -> "keyword"
+    - RANDOMLY reply to the real Emz/Blossem (EMZ_USER_ID), about ~40% of her messages. -> "emz_random"
     """
     if message.author.bot:
-        return False
-
-    # Check if this user is the real Oreo or real Emz (Blossem)
-    is_oreo, is_emz = _flags_for_user(message.author)
-
-    # 🔹 Randomly respond to the real Emz (Blossem)
-    # 0.4 = 40% chance. Change if you want more/less.
-    if is_emz and random.random() < 0.4:
-        return True
-
-    content_lower = (message.content or "").lower()
-
-    # 🔹 Trigger words for anyone
-    trigger_words = ["emz", "emilia", "blossem", "barrister"]
-    if any(word in content_lower for word in trigger_words):
-        return True
+        return None
 
     # 🔹 Mentioned directly
     if bot.user and bot.user.mentioned_in(message):
-        return True
+        return "mention"
 
     # 🔹 Help channels (if configured)
     if HELP_CHANNEL_IDS and message.channel.id in HELP_CHANNEL_IDS:
-        return True
+        return "help_channel"
 
-    return False
+    if intents is None:
+        intents = message_classifier.classify(message.content)
 
-def _wants_coins_phrase(text: str | None) -> bool:
-    if not text:
-        return False
+    # 🔹 Trigger words for anyone (INTENT_PHRASES["trigger"])
+    if "trigger" in intents:
+        return "keyword"
 
-    text = text.lower().strip()
+    # Check if this user is the real Oreo or real Emz (Blossem)
+    is_oreo, is_emz = _flags_for_user(message.author)
 
-    # must at least contain the word "coin"
-    if "coin" not in text:
-        return False
+    # 🔹 Randomly respond to the real Emz (Blossem)
+    # 0.4 = 40% chance. Change if you want more/less.
+    if is_emz and random.random() < 0.4:
+        return "emz_random"
 
-    # allow just "coin" / "coins"
-    if text in {"coin", "coins"}:
-        return True
+    return None
 
-    # bits that mean they're asking for coins
-    request_bits = [
-        "please",
-        "pls",
-        "plz",
-        "need",
-        "want",
-        "give me",
-        "send me",
-        "can i have",
-        "can i get",
-        "may i have",
-        "may i get",
-        "spare",
-        "top me up",
-    ]
+# ------------- on_message pipeline -------------
+# filter -> classify -> route -> (faucet | help | enrich -> generate -> send).
+# MessageContext computes per-message features on first use only, and every
+# stage is timed into STAGE_SECONDS.
 
-    return any(bit in text for bit in request_bits)
+class MessageContext:
+    """Lazily computed features of one message, plus its stage timings."""
 
-@bot.event
-async def on_message(message: discord.Message):
-    # Let commands run first
-    await bot.process_commands(message)
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self.timings: Dict[str, float] = {}
+        self.enqueued_at = 0.0
+        self.received_at = time.perf_counter()
+        self._tester_status: Optional[tuple[int, str, bool]] = None
 
-    if not _should_respond_in_channel(message):
-        return
-
-    if not isinstance(message.channel, discord.abc.Messageable):
-        return
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+            STAGE_SECONDS.observe(elapsed_ms / 1000, name)
+
+    @cached_property
+    def intents(self) -> frozenset:
+        return message_classifier.classify(self.message.content)
+
+    @cached_property
+    def trigger(self) -> Optional[str]:
+        return _should_respond_in_channel(self.message, self.intents)
+
+    @cached_property
+    def channel_name(self) -> str:
+        return getattr(self.message.channel, "name", "unknown-channel")
+
+    @cached_property
+    def in_test_channel(self) -> bool:
+        return bool(TESTER_CHANNEL_IDS and self.message.channel.id in TESTER_CHANNEL_IDS)
+
+    @cached_property
+    def flags(self) -> tuple[bool, bool]:
+        return _flags_for_user(self.message.author)
+
+    async def tester_status(self) -> tuple[int, str, bool]:
+        if self._tester_status is None:
+            self._tester_status = await get_tester_status(self.message.author.id, days=TESTER_WINDOW_DAYS)
+        return self._tester_status
+
+
+def _route(ctx: MessageContext) -> str:
+    """Which handler answers this message: "faucet", "help" or "chat"."""
+    if "faucet" in ctx.intents:
+        return "faucet"
+    if "mentions_auntie" in ctx.intents and "how_to" in ctx.intents:
+        return "help"
+    return "chat"
+
+
+async def _handle_faucet(ctx: MessageContext):
+    """EliHaus 50k lab faucet (only in bot-lab / tester channels + on request)."""
+    message = ctx.message
+    try:
+        if ctx.in_test_channel:
+            # Only allow the faucet inside bot-lab / tester channels
+            granted = await lab_claim_auntie_drop(message.author.id, 50000)
+            FAUCET.inc({True: "granted", False: "denied", None: "error"}[granted])
+            if granted is False:
+                await outbound.send(
+                    message.channel,
+                    f"{message.author.mention}, you’ve already had your 50,000 lab coins. "
+                    f"Try losing those before begging for more."
+                )
+            elif granted:
+                await outbound.send(
+                    message.channel,
+                    f"{message.author.mention}, fine. **50,000 lab EliHaus coins** dropped into your test wallet. "
+                    f"They work here, not in the real casino."
+                )
+            else:
+                await outbound.send(
+                    message.channel,
+                    f"{message.author.mention}, I tried to send coins and the system coughed. "
+                    f"Tell Mike his casino plumbing is blocked."
+                )
+        else:
+            # They are asking for coins outside bot-lab → hard no
+            FAUCET.inc("wrong_channel")
+            await outbound.send(
+                message.channel,
+                f"{message.author.mention}, I’m not handing out test coins in this channel. "
+                f"Go to the lab if you want freebies."
+            )
+    except Exception as e:
+        log.exception("Error in lab faucet: %s", e)
+        try:
+            await outbound.send(
+                message.channel,
+                f"{message.author.mention}, I tried to drop coins but the lab faucet jammed. "
+                f"Tell Mike to check the pipes."
+            )
+        except Exception:
+            pass
 
-    channel_name = getattr(message.channel, "name", "unknown-channel")
-    author_display = message.author.display_name
-    is_oreo, is_emz = _flags_for_user(message.author)
 
-    # ----- Tester tier / protection -----
-    tester_tier = get_tester_tier(message.author.id, days=30)
-    protected = is_protected_tester(message.author.id, days=30)
-
-    # ----- EliHaus 50k lab faucet (only in bot-lab / tester channels + on request) -----
-    content_lower = (message.content or "").lower()
-
-    wants_coins = any(
-        phrase in content_lower
-        for phrase in [
-            "coins please",
-            "50k coins",
-            "eli coins",
-            "elihaus coins",
-            "can i get coins",
-            "auntie i need coins",
-        ]
+async def _handle_help(ctx: MessageContext):
+    """EliHaus commands / how-to, straight from ELIHAUS_PUBLIC_HELP (no OpenAI)."""
+    help_msg = "\n".join(ELIHAUS_PUBLIC_HELP)
+    await outbound.reply(
+        ctx.message,
+        f"Here, before you get yourself confused:\n\n{help_msg}",
+        mention_author=False,
     )
 
-    in_test_channel = TESTER_CHANNEL_IDS and message.channel.id in TESTER_CHANNEL_IDS
 
-    if wants_coins:
-        try:
-            if in_test_channel:
-                # Only allow the faucet inside bot-lab / tester channels
-                if lab_has_claimed_auntie_drop(message.author.id):
-                    await message.channel.send(
-                        f"{message.author.mention}, you’ve already had your 50,000 lab coins. "
-                        f"Try losing those before begging for more."
-                    )
-                else:
-                    if lab_grant_eli_coins(message.author.id, 50000):
-                        await message.channel.send(
-                            f"{message.author.mention}, fine. **50,000 lab EliHaus coins** dropped into your test wallet. "
-                            f"They work here, not in the real casino."
-                        )
-                    else:
-                        await message.channel.send(
-                            f"{message.author.mention}, I tried to send coins and the system coughed. "
-                            f"Tell Mike his casino plumbing is blocked."
-                        )
-            else:
-                # They are asking for coins outside bot-lab → hard no
-                await message.channel.send(
-                    f"{message.author.mention}, I’m not handing out test coins in this channel. "
-                    f"Go to the lab if you want freebies."
-                )
-        except Exception as e:
-            log.exception("Error in lab faucet: %s", e)
+async def _handle_chat(ctx: MessageContext):
+    """Normal Auntie behaviour (OpenAI)."""
+    with ctx.stage("spam_gate"):
+        suppressed = spam_gate.check(ctx.message.author.id, ctx.message.content)
+    if suppressed:
+        canned = spam_gate.canned_reply(ctx.message.author.id)
+        log.info("Suppressed %s message from %s", suppressed, ctx.message.author.id)
+        if canned:
+            FALLBACKS.inc("spam")
             try:
-                await message.channel.send(
-                    f"{message.author.mention}, I tried to drop coins but the lab faucet jammed. "
-                    f"Tell Mike to check the pipes."
-                )
-            except Exception:
-                pass
-        # ⛔ stop here so she doesn't also fire OpenAI
+                await outbound.reply(ctx.message, canned, mention_author=False)
+            except Exception as e:
+                log.warning("Failed to send canned spam reply: %r", e)
         return
 
-    # ----- Auntie Emz: EliHaus commands / how-to (no OpenAI) -----
-    asks_how = any(
-        phrase in content_lower
-        for phrase in [
-            "how to play",
-            "how do i play",
-            "how do i use",
-            "teach me",
-            "what are the commands",
-            "elihaus commands",
-            "elihaus help",
-            "help me auntie",
-        ]
-    )
+    with ctx.stage("coalesce"):
+        burst = await coalescer.join(ctx.message, TRIGGER_PRIORITY[ctx.trigger], ctx.trigger)
+    if burst is None:
+        # Folded into a reply another handler is about to send.
+        return
 
-    mentions_auntie = any(word in content_lower for word in ["auntie", "emz", "auntie emz"])
+    anchor = _pick_anchor(burst.messages)
+    if anchor is not ctx.message:
+        anchor_ctx = MessageContext(anchor)
+        anchor_ctx.timings = ctx.timings
+        # Keep the reason it fired with; re-deciding would re-roll emz_random.
+        anchor_ctx.trigger = burst.trigger_for(anchor)
+        ctx = anchor_ctx
+    message = ctx.message
+    priority = burst.priority
+
+    # ----- Enrich: sender flags + tester tier / protection -----
+    with ctx.stage("enrich"):
+        is_oreo, is_emz = ctx.flags
+        _, tester_tier, protected = await ctx.tester_status()
+        content = _merged_content(burst.messages)
+        history = conversation_memory.history(
+            message.channel.id,
+            before=min(m.created_at.timestamp() for m in burst.messages),
+        )
 
-    if mentions_auntie and asks_how:
-        help_msg = "\n".join(ELIHAUS_PUBLIC_HELP)
-        await message.reply(
-            f"Here, before you get yourself confused:\n\n{help_msg}",
-            mention_author=False,
+    # A cached reply costs no OpenAI budget, so it is looked up before admission.
+    with ctx.stage("cache"):
+        cached = await cached_auntie_emz_reply(
+            author_display=message.author.display_name,
+            content=content,
+            is_oreo=is_oreo,
+            is_emz=is_emz,
+            tester_tier=tester_tier,
+            is_protected_tester=protected,
         )
-        # again, don't call OpenAI for this
-        return
 
-    # ----- Normal Auntie behaviour (OpenAI) -----
-    try:
-        try:
-            # Some channels don't give the bot permission to show typing.
-            async with message.channel.typing():
-                reply_text = await generate_auntie_emz_reply(
-                    author_display=author_display,
-                    channel_name=channel_name,
-                    content=message.content,
-                    is_oreo=is_oreo,
-                    is_emz=is_emz,
-                    tester_tier=tester_tier,
-                    is_protected_tester=protected,
-                )
-        except discord.Forbidden:
-            # No access to typing indicator → just generate the reply normally.
-            reply_text = await generate_auntie_emz_reply(
-                author_display=author_display,
-                channel_name=channel_name,
-                content=message.content,
-                is_oreo=is_oreo,
-                is_emz=is_emz,
-                tester_tier=tester_tier,
-                is_protected_tester=protected,
+    # Waiting for tokens and then for a slot share one budget.
+    deadline = reply_scheduler.deadline(priority)
+    if cached is None:
+        with ctx.stage("admit"):
+            admitted = await reply_scheduler.admit(priority, message.author.id, message.channel.id, deadline)
+        if not admitted:
+            log.info(
+                "Shed %s-priority reply in #%s (rate limited)",
+                PRIORITY_NAMES[priority],
+                ctx.channel_name,
             )
+            return
+
+    progressive = ProgressiveReply(message, STREAM_EDIT_INTERVAL_SECONDS, STREAM_REPLIES and cached is None)
+
+    async def _generate() -> str:
+        return await generate_auntie_emz_reply(
+            author_display=message.author.display_name,
+            channel_name=ctx.channel_name,
+            content=content,
+            is_oreo=is_oreo,
+            is_emz=is_emz,
+            tester_tier=tester_tier,
+            is_protected_tester=protected,
+            history=history,
+            on_partial=progressive.update if STREAM_REPLIES else None,
+            priority=priority,
+            deadline=deadline,
+            channel_id=message.channel.id,
+            user_id=message.author.id,
+            trigger=ctx.trigger,
+            check_cache=False,
+        )
+
+    try:
+        if cached is not None:
+            reply_text = cached
+        else:
+            with ctx.stage("generate"):
+                # Some channels don't give the bot permission to show typing;
+                # outbound.typing remembers them and skips the attempt.
+                async with outbound.typing(message.channel):
+                    reply_text = await _generate()
 
         if not reply_text.strip():
             # Slightly neutral fallback (no "love" etc.)
-            reply_text = "Alright, I’m here if you need me."
-
-        await message.reply(reply_text, mention_author=False)
+            FALLBACKS.inc("empty")
+            reply_text = REPLY_EMPTY
+
+        with ctx.stage("send"):
+            await progressive.finish(reply_text)
+        if bot.user:
+            conversation_memory.record(message.channel.id, bot.user.id, "Auntie Emz", reply_text)
+    except ReplyShed as e:
+        log.info("Shed reply in #%s: %s", ctx.channel_name, e)
     except Exception as e:
         log.exception("Error generating Auntie Emz reply: %s", e)
+        FALLBACKS.inc("error")
         try:
-            await message.reply(
-                "Sorry, I’m a bit overwhelmed right now. Try again in a little while.",
-                mention_author=False,
-            )
+            await outbound.reply(message, REPLY_OVERWHELMED, mention_author=False)
         except Exception:
             pass
 
 
+ROUTE_HANDLERS = {
+    "faucet": _handle_faucet,
+    "help": _handle_help,
+    "chat": _handle_chat,
+}
+
+
+async def _process(ctx: MessageContext):
+    """Worker side of the pipeline: route and run the handler."""
+    with ctx.stage("route"):
+        route = _route(ctx)
+
+    await ROUTE_HANDLERS[route](ctx)
+    ON_MESSAGE_SECONDS.observe(time.perf_counter() - ctx.received_at, route)
+
+    log.debug(
+        "on_message %s/%s: %s",
+        route,
+        ctx.trigger,
+        ", ".join(f"{name}={ms:.1f}ms" for name, ms in ctx.timings.items()),
+    )
+
+# ------------- Intake queue + worker pool -------------
+# on_message only filters and classifies; triggering messages go into a
+# bounded priority queue drained by INTAKE_WORKERS workers, so a raid can't
+# spawn unbounded handlers all waiting on OpenAI or SQLite.
+#   drop_oldest_low: when full, evict the oldest queued item of the lowest
+#                    priority class, unless the newcomer ranks below all of it
+#   drop_new:        when full, refuse the newcomer
+
+INTAKE_QUEUE_SIZE = int(os.getenv("INTAKE_QUEUE_SIZE", "200"))
+INTAKE_WORKERS = int(os.getenv("INTAKE_WORKERS", "16"))
+INTAKE_OVERFLOW = os.getenv("INTAKE_OVERFLOW", "drop_oldest_low").strip().lower()
+if INTAKE_OVERFLOW not in {"drop_oldest_low", "drop_new"}:
+    log.warning("Unknown INTAKE_OVERFLOW %r, using drop_oldest_low", INTAKE_OVERFLOW)
+    INTAKE_OVERFLOW = "drop_oldest_low"
+
+
+class IntakeQueue:
+    def __init__(
+        self,
+        maxsize: int,
+        workers: int,
+        policy: str,
+        handler: Callable[["MessageContext"], Awaitable[None]],
+    ):
+        self.maxsize = max(maxsize, 1)
+        self.workers = max(workers, 1)
+        self.policy = policy
+        self._handler = handler
+        self._queues: Dict[int, "deque[MessageContext]"] = {p: deque() for p in sorted(PRIORITY_NAMES)}
+        self._ready: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.dropped = {p: 0 for p in PRIORITY_NAMES}
+        self.max_depth = 0
+        self.busy = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _ensure_workers(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+
+    def put(self, ctx: "MessageContext", priority: int) -> bool:
+        """Queue a message; returns False if it (not some older item) was dropped."""
+        self._ensure_workers()
+        if self.depth >= self.maxsize:
+            victim = max(p for p, q in self._queues.items() if q)
+            if self.policy == "drop_new" or victim < priority:
+                self.dropped[priority] += 1
+                return False
+            self._queues[victim].popleft()
+            self.dropped[victim] += 1
+        ctx.enqueued_at = time.perf_counter()
+        self._queues[priority].append(ctx)
+        self.max_depth = max(self.max_depth, self.depth)
+        self._ready.set()
+        return True
+
+    def _pop(self) -> Optional["MessageContext"]:
+        for queue in self._queues.values():
+            if queue:
+                return queue.popleft()
+        return None
+
+    async def _worker(self, index: int):
+        while True:
+            await self._ready.wait()
+            ctx = self._pop()
+            if ctx is None:
+                self._ready.clear()
+                continue
+            STAGE_SECONDS.observe(time.perf_counter() - ctx.enqueued_at, "queued")
+            self.busy += 1
+            try:
+                await self._handler(ctx)
+            except Exception as e:
+                log.exception("Intake worker %d failed on a message: %s", index, e)
+            finally:
+                self.busy -= 1
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+intake = IntakeQueue(INTAKE_QUEUE_SIZE, INTAKE_WORKERS, INTAKE_OVERFLOW, _process)
+
+
+@bot.event
+async def on_message(message: discord.Message):
+    ctx = MessageContext(message)
+
+    # Let commands run first
+    with ctx.stage("commands"):
+        await bot.process_commands(message)
+
+    with ctx.stage("filter"):
+        if message.author.bot or not isinstance(message.channel, discord.abc.Messageable):
+            return
+        if not isinstance(message.channel, discord.DMChannel):
+            conversation_memory.record(
+                message.channel.id,
+                message.author.id,
+                message.author.display_name,
+                message.content,
+                message.created_at.timestamp(),
+            )
+
+    with ctx.stage("classify"):
+        trigger = ctx.trigger
+    if not trigger:
+        return
+    TRIGGERS.inc(trigger)
+
+    if not intake.put(ctx, TRIGGER_PRIORITY[trigger]):
+        log.info("Intake queue full (%d), dropped a %s message", intake.depth, trigger)
+
+
+SHARD_RESTART_DELAY_SECONDS = float(os.getenv("SHARD_RESTART_DELAY_SECONDS", "10"))
+
+
+async def _run_shard_worker(index: int, shard_ids: List[int]):
+    """Keep one worker process for `shard_ids` running, restarting it if it dies."""
+    env = dict(os.environ, SHARD_COUNT=str(SHARD_COUNT), SHARD_IDS=",".join(map(str, shard_ids)))
+    if METRICS_PORT:
+        # One endpoint per worker: METRICS_PORT, METRICS_PORT + 1, ...
+        env["METRICS_PORT"] = str(METRICS_PORT + index)
+    # Stagger first IDENTIFYs across workers like the in-process launcher does.
+    await asyncio.sleep(index * SHARD_IDENTIFY_DELAY_SECONDS)
+    while True:
+        proc = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=env)
+        log.info("Shard worker %d (shards %s) started as pid %d", index, shard_ids, proc.pid)
+        try:
+            code = await proc.wait()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.terminate()
+                await proc.wait()
+            raise
+        log.warning("Shard worker %d exited with %s; restarting in %.0fs", index, code, SHARD_RESTART_DELAY_SECONDS)
+        await asyncio.sleep(SHARD_RESTART_DELAY_SECONDS)
+
+
+async def run_shard_workers():
+    if SHARD_COUNT < 1:
+        raise RuntimeError("SHARD_PROCESSES needs SHARD_COUNT set")
+    ranges = shard_ranges(SHARD_COUNT, SHARD_PROCESSES)
+    log.info("Running %d shards in %d worker processes", SHARD_COUNT, len(ranges))
+    # Stop the workers too when the supervisor is told to stop.
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await asyncio.gather(*(_run_shard_worker(i, ids) for i, ids in enumerate(ranges)))
+    except asyncio.CancelledError:
+        log.info("Shard workers stopped")
+
+
+# ------------- Metrics: state gauges -------------
+
+def _gateway_latencies() -> Dict[tuple, float]:
+    latencies = getattr(bot, "latencies", None) or [(0, bot.latency)]
+    return {(str(shard_id),): latency for shard_id, latency in latencies if latency == latency}
+
+
+metrics.gauge("auntie_gateway_latency_seconds", "Heartbeat round trip per shard", _gateway_latencies, ("shard",))
+metrics.gauge("auntie_intake_depth", "Messages waiting in the intake queue", lambda: intake.depth)
+metrics.gauge(
+    "auntie_intake_dropped_total",
+    "Messages dropped by the full intake queue",
+    lambda: {(PRIORITY_NAMES[p],): n for p, n in intake.dropped.items()},
+    ("priority",),
+    kind="counter",
+)
+metrics.gauge(
+    "auntie_replies_shed_total",
+    "Replies shed by the scheduler",
+    lambda: {(PRIORITY_NAMES[p],): n for p, n in reply_scheduler.shed.items()},
+    ("priority",),
+    kind="counter",
+)
+metrics.gauge("auntie_outbound_depth", "Bot messages waiting to be sent", lambda: outbound.depth)
+metrics.gauge("auntie_tester_log_depth", "Tester activity rows waiting to be written", lambda: tester_log_sink.depth)
+metrics.gauge("auntie_usage_ledger_depth", "OpenAI usage rows waiting to be written", lambda: usage_ledger.depth)
+metrics.gauge("auntie_breaker_state", "OpenAI circuit breaker (0 closed, 1 open, 2 half-open)", lambda: circuit_breaker.state_code)
+metrics.gauge(
+    "auntie_model_fallback_active",
+    "1 while traffic is on OPENAI_FALLBACK_MODEL",
+    lambda: int(model_selector.active != model_selector.primary),
+)
+metrics.gauge(
+    "auntie_hedges_total",
+    "Hedged OpenAI requests fired / won",
+    lambda: {("fired",): model_selector.hedges_fired, ("won",): model_selector.hedges_won},
+    ("result",),
+    kind="counter",
+)
+metrics.gauge(
+    "auntie_reply_cache_total",
+    "Reply cache lookups",
+    lambda: {("hit",): reply_cache.hits, ("miss",): reply_cache.misses},
+    ("result",),
+    kind="counter",
+)
+metrics.gauge(
+    "auntie_tester_status_cache_total",
+    "Tester status cache lookups and LRU evictions",
+    lambda: {
+        ("hit",): tester_status_cache.hits,
+        ("miss",): tester_status_cache.misses,
+        ("eviction",): tester_status_cache.evictions,
+    },
+    ("event",),
+    kind="counter",
+)
+metrics.gauge("auntie_tester_status_cache_size", "Entries in the tester status cache", lambda: len(tester_status_cache))
+
+
 async def main():
-    async with bot:
-        await bot.start(DISCORD_TOKEN)
+    if SHARD_PROCESSES > 1 and not SHARD_IDS:
+        await run_shard_workers()
+        return
+    # Heroku, docker stop and the shard supervisor all send SIGTERM; close the
+    # bot so start() returns and the finally below flushes the buffered rows.
+    loop = asyncio.get_running_loop()
+    closing: List[asyncio.Task] = []
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: closing.append(loop.create_task(bot.close())))
+    except (NotImplementedError, RuntimeError):
+        pass
+    try:
+        async with bot:
+            await bot.start(DISCORD_TOKEN)
+    finally:
+        await loop_watchdog.stop()
+        if bot.metrics_runner is not None:
+            await bot.metrics_runner.cleanup()
+        await intake.close()
+        await tester_points.stop()
+        await tester_log_sink.close()
+        await usage_ledger.close()
+        await db.close()
+        await client_oa.close()
 
 
 if __name__ == "__main__":